@@ -0,0 +1,145 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import json
+import pickle
+import time
+import traceback
+
+from Exceptions import KnownErrorVerdict
+from normalizer import normalize
+import profiling
+from main import (
+    parse,
+    instrument,
+    run_test,
+    add_options,
+    options_of,
+    artifacts_dir,
+    keep_artifact,
+    print_verdict,
+    verdicts_of,
+)
+
+
+def read_manifest(manifest):
+    """Reads the jobs of a manifest: one JSON object per line with the keys
+    `program`, `witness` and (optionally) `mode`."""
+    jobs = []
+    with open(manifest, "r") as f:
+        for line in f:
+            if line.strip():
+                job = json.loads(line)
+                job.setdefault("mode", "normal")
+                jobs.append(job)
+    return jobs
+
+
+def validate_program(program, jobs, args):
+    """Validates every job of a program, parsing the program only once.
+
+    Each witness is applied to a fresh copy of the AST, unpickled from a
+    snapshot taken right after parsing.
+    """
+    with profiling.phase("normalize"):
+        with open(program, "r") as f:
+            content = normalize(f.read())
+    try:
+        options = options_of(args, time.monotonic())
+        ast = parse(content, program, options["cache_dir"], options["cache_size"])
+        snapshot = pickle.dumps(ast, pickle.HIGHEST_PROTOCOL)
+        error = None
+    except KnownErrorVerdict as e:
+        error = e.verdict
+    for job in jobs:
+        start_time = time.monotonic()
+        verdict = error
+        artifacts = artifacts_dir(args.keep_artifacts)
+        keep_artifact(artifacts, "input.c", content)
+        if verdict is None:
+            try:
+                ast = pickle.loads(snapshot)
+                lines, modified, ordered = instrument(ast, content, job["witness"])
+                verdict = run_test(
+                    ast,
+                    job["mode"],
+                    artifacts=artifacts,
+                    keep_lines=lines,
+                    source=content,
+                    modified=modified,
+                    ordered=ordered,
+                    **options_of(args, start_time),
+                )
+            except KnownErrorVerdict as e:
+                verdict = e.verdict
+        print_verdict(job["mode"], verdict)
+        if job["mode"] == "all":
+            verdict = verdicts_of(verdict)
+        yield dict(job, verdict=verdict)
+
+
+def validate_batch(jobs, output, args):
+    programs = {}
+    for job in jobs:
+        programs.setdefault(job["program"], []).append(job)
+    for program, program_jobs in programs.items():
+        done = 0
+        try:
+            for record in validate_program(program, program_jobs, args):
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                done = done + 1
+        except Exception:
+            traceback.print_exc()
+            for job in program_jobs[done:]:
+                verdict = "Unknown error"
+                if job["mode"] == "all":
+                    verdict = verdicts_of(verdict)
+                output.write(json.dumps(dict(job, verdict=verdict)) + "\n")
+            output.flush()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Validate many witnesses, parsing each program only once"
+    )
+    parser.add_argument(
+        "manifest",
+        metavar="<manifest.jsonl>",
+        type=str,
+        help="Jobs, one JSON object per line: "
+        '{"program": ..., "witness": ..., "mode": ...}',
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        metavar="<verdicts.jsonl>",
+        type=str,
+        required=True,
+        help="Verdict records, one JSON object per job",
+    )
+    add_options(parser)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    jobs = read_manifest(args.manifest)
+    with profiling.profiled(args.profile, args.profile_python):
+        with open(args.output, "w") as output:
+            validate_batch(jobs, output, args)
@@ -0,0 +1,407 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+PRELUDE = """typedef unsigned long int pthread_t;
+union pthread_attr_t { char __size[56]; long int __align; };
+typedef union pthread_attr_t pthread_attr_t;
+extern int pthread_create (pthread_t *__restrict __newthread, const pthread_attr_t *__restrict __attr, void *(*__start_routine) (void *), void *__restrict __arg) __attribute__ ((__nothrow__)) __attribute__ ((__nonnull__ (1, 3)));
+extern int pthread_join (pthread_t __th, void **__thread_return);
+extern void abort (void) __attribute__ ((__nothrow__ , __leaf__)) __attribute__ ((__noreturn__));
+void reach_error() { abort(); }
+"""
+
+PADDING = "extern int __padding_{} (const char *__restrict __s, int __n) __attribute__ ((__nothrow__ , __leaf__));\n"
+
+WITNESS_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<key attr.name="witness-type" attr.type="string" for="graph" id="witness-type"/>
+<key attr.name="threadId" attr.type="string" for="edge" id="threadId"/>
+<key attr.name="startline" attr.type="string" for="edge" id="startline"/>
+<key attr.name="endline" attr.type="string" for="edge" id="endline"/>
+<key attr.name="entry" attr.type="string" for="node" id="entry"><default>false</default></key>
+<key attr.name="sink" attr.type="string" for="node" id="sink"><default>false</default></key>
+<key attr.name="violation" attr.type="string" for="node" id="violation"><default>false</default></key>
+<graph edgedefault="directed">
+<data key="witness-type">violation_witness</data>
+"""
+
+
+class Program:
+    """A synthetic pthread program: `threads` threads executing `statements`
+    statements each, after `padding` unused declarations."""
+
+    def __init__(self, threads, statements, padding=0):
+        self.lines = PRELUDE.splitlines(keepends=True)
+        self.lines.extend(PADDING.format(i) for i in range(padding))
+        self.lines.append("int shared = 0;\n")
+        self.statement_lines = {}
+        for thread in range(1, threads + 1):
+            self.lines.extend([f"void *thread{thread}(void *arg)\n", "{\n"])
+            self.add("int value = 0;")
+            self.statement_lines[thread] = []
+            for statement in range(statements):
+                self.statement_lines[thread].append(
+                    self.add(f"value = value + {statement};")
+                )
+            self.add("shared = shared + value;")
+            self.add("return 0;")
+            self.lines.append("}\n")
+        self.lines.extend(["int main()\n", "{\n"])
+        for thread in range(1, threads + 1):
+            self.add(f"pthread_t t{thread};")
+        self.create_lines = [
+            self.add(f"pthread_create(&t{thread}, 0, thread{thread}, 0);")
+            for thread in range(1, threads + 1)
+        ]
+        for thread in range(1, threads + 1):
+            self.add(f"pthread_join(t{thread}, 0);")
+        self.check_line = self.add(
+            f"if (shared == {threads * statements * (statements - 1) // 2}) reach_error();"
+        )
+        self.add("return 0;")
+        self.lines.append("}\n")
+
+    def add(self, statement):
+        """Adds a line with the statement, returns its line number."""
+        self.lines.append(f"  {statement}\n")
+        return len(self.lines)
+
+    def source(self):
+        return "".join(self.lines)
+
+    def schedule(self, edges, chunk):
+        """Returns a linear schedule of (thread id, line) witness edges: main
+        creates the threads, then the threads execute `chunk` statements at a
+        time in round robin, then main checks the result."""
+        schedule = [(0, line) for line in self.create_lines]
+        positions = {thread: 0 for thread in self.statement_lines}
+        threads = itertools.cycle(sorted(self.statement_lines))
+        while len(schedule) < edges - 1 and any(
+            positions[t] < len(lines) for t, lines in self.statement_lines.items()
+        ):
+            thread = next(threads)
+            lines = self.statement_lines[thread]
+            for line in lines[positions[thread] : positions[thread] + chunk]:
+                if len(schedule) < edges - 1:
+                    schedule.append((thread, line))
+                    positions[thread] = positions[thread] + 1
+        schedule.append((0, self.check_line))
+        return schedule
+
+
+def sized_program(threads, statements, size):
+    """Returns a Program padded to at least `size` bytes."""
+    missing = size - len(Program(threads, statements).source())
+    padding = max(0, -(-missing // len(PADDING.format(0))))
+    return Program(threads, statements, padding)
+
+
+def witness(schedule):
+    parts = [WITNESS_HEADER, '<node id="N0"><data key="entry">true</data></node>\n']
+    for i in range(1, len(schedule)):
+        parts.append(f'<node id="N{i}"/>\n')
+    parts.append(
+        f'<node id="N{len(schedule)}"><data key="violation">true</data></node>\n'
+    )
+    for i, (thread, line) in enumerate(schedule):
+        parts.append(
+            f'<edge source="N{i}" target="N{i + 1}">'
+            f'<data key="threadId">{thread}</data>'
+            f'<data key="startline">{line}</data>'
+            f'<data key="endline">{line}</data></edge>\n'
+        )
+    parts.append("</graph>\n</graphml>\n")
+    return "".join(parts)
+
+
+def run_case(args):
+    """Validates one generated program (in a fresh interpreter), and writes the
+    profiling report of the validation to args.report."""
+    import profiling
+    from Exceptions import KnownErrorVerdict
+    from main import parse, instrument, run_test
+    from normalizer import normalize
+
+    profile = profiling.start()
+    try:
+        with profiling.phase("normalize"):
+            with open(args.program, "r") as f:
+                content = normalize(f.read())
+        try:
+            ast = parse(content, args.program)
+            lines, modified, ordered = instrument(ast, content, args.witness)
+            verdict = run_test(
+                ast,
+                args.mode,
+                keep_lines=lines,
+                source=content,
+                modified=modified,
+                ordered=ordered,
+                jobs=args.jobs,
+                runs=args.runs,
+                fork_server=args.fork_server,
+                sync=args.sync,
+                run_timeout=args.run_timeout,
+            )
+        except KnownErrorVerdict as e:
+            verdict = e.verdict
+    finally:
+        profiling.stop()
+    report = profile.report()
+    runs = report.pop("runs")
+    durations = [run["duration"] for run in runs]
+    peak_rss = [run["peak_rss_kib"] for run in runs if run["peak_rss_kib"]]
+    report["runs"] = {
+        "count": len(durations),
+        "total": sum(durations),
+        "min": min(durations, default=None),
+        "max": max(durations, default=None),
+        "max_peak_rss_kib": max(peak_rss, default=None),
+    }
+    report["verdict"] = verdict
+    with open(args.report, "w") as f:
+        json.dump(report, f)
+
+
+def case_options(args):
+    options = ["--runs", str(args.runs), "--jobs", str(args.jobs), "--sync", args.sync]
+    options = options + ["--mode", args.mode]
+    options = options + ["--run-timeout", str(args.run_timeout)]
+    return options + (["--fork-server"] if args.fork_server else [])
+
+
+def run_suite(args):
+    workdir = args.keep or tempfile.mkdtemp(prefix="c2tt-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    cases = []
+    grid = itertools.product(args.threads, args.statements, args.edges, args.size_kb)
+    try:
+        for threads, statements, edges, size_kb in grid:
+            name = f"t{threads}-s{statements}-e{edges}-k{size_kb}"
+            program = sized_program(threads, statements, size_kb * 1024)
+            schedule = program.schedule(edges, args.chunk)
+            program_file = os.path.join(workdir, name + ".i")
+            witness_file = program_file + ".graphml"
+            report_file = os.path.join(workdir, name + ".json")
+            with open(program_file, "w") as f:
+                f.write(program.source())
+            with open(witness_file, "w") as f:
+                f.write(witness(schedule))
+            for repetition in range(args.repeat):
+                subprocess.run(
+                    [
+                        sys.executable,
+                        os.path.abspath(__file__),
+                        "case",
+                        program_file,
+                        witness_file,
+                        report_file,
+                        *case_options(args),
+                    ],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    check=True,
+                )
+                with open(report_file, "r") as f:
+                    report = json.load(f)
+                case = {
+                    "name": name,
+                    "threads": threads,
+                    "statements": statements,
+                    "edges": len(schedule),
+                    "bytes": os.path.getsize(program_file),
+                    "lines": len(program.lines),
+                    "repetition": repetition,
+                }
+                case.update(report)
+                cases.append(case)
+                phases = ", ".join(
+                    f"{phase} {total['wall']:.3f}s"
+                    for phase, total in report["totals"].items()
+                )
+                print(f"{name} [{report['verdict']}]: {phases}", flush=True)
+    finally:
+        if not args.keep:
+            for entry in os.listdir(workdir):
+                os.remove(os.path.join(workdir, entry))
+            os.rmdir(workdir)
+    result = {"environment": environment(), "cases": cases}
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+
+def environment():
+    import pycparser
+    from compiler import compiler_version
+
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        revision = ""
+    return {
+        "revision": revision,
+        "python": platform.python_version(),
+        "pycparser": pycparser.__version__,
+        "compiler": compiler_version().decode(errors="replace").splitlines()[0],
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(args):
+    """Prints the wall time ratio (new / base) of each phase of each case."""
+    results = []
+    for path in (args.base, args.new):
+        with open(path, "r") as f:
+            cases = {}
+            for case in json.load(f)["cases"]:
+                cases.setdefault(case["name"], []).append(case)
+            results.append(cases)
+    base, new = results
+    for name in base:
+        if name not in new:
+            continue
+        ratios = []
+        startup = [
+            min(case.get("startup") or 0 for case in cases[name]) for cases in results
+        ]
+        if all(startup):
+            before, after = startup
+            ratio = after / before
+            ratios.append(f"startup {before:.3f}s -> {after:.3f}s ({ratio:.2f}x)")
+        for phase in base[name][0]["totals"]:
+            before = min(case["totals"][phase]["wall"] for case in base[name])
+            after = min(
+                case["totals"].get(phase, {"wall": float("nan")})["wall"]
+                for case in new[name]
+            )
+            ratio = after / before if before > 0 else float("nan")
+            ratios.append(f"{phase} {before:.3f}s -> {after:.3f}s ({ratio:.2f}x)")
+        print(f"{name}: " + ", ".join(ratios))
+
+
+def sizes(text):
+    return [int(value) for value in text.split(",")]
+
+
+def add_case_options(parser):
+    parser.add_argument("--runs", metavar="<n>", type=int, default=10)
+    parser.add_argument("--jobs", "-j", metavar="<n>", type=int, default=1)
+    parser.add_argument("--sync", choices=["futex", "mutex"], default="futex")
+    parser.add_argument(
+        "--mode", choices=["strict", "normal", "permissive", "all"], default="normal"
+    )
+    parser.add_argument("--run-timeout", metavar="<seconds>", type=float, default=10)
+    parser.add_argument("--fork-server", action="store_true")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the validation stages on synthetic programs and witnesses"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Generate and validate the benchmark cases")
+    run.add_argument(
+        "--output",
+        "-o",
+        metavar="<results.json>",
+        type=str,
+        required=True,
+        help="Results of the cases",
+    )
+    run.add_argument(
+        "--threads",
+        metavar="<n,...>",
+        type=sizes,
+        default=[2, 8],
+        help="Numbers of threads (default: 2,8)",
+    )
+    run.add_argument(
+        "--statements",
+        metavar="<n,...>",
+        type=sizes,
+        default=[100],
+        help="Numbers of statements per thread (default: 100)",
+    )
+    run.add_argument(
+        "--edges",
+        metavar="<n,...>",
+        type=sizes,
+        default=[20, 200],
+        help="Numbers of witness edges (default: 20,200)",
+    )
+    run.add_argument(
+        "--size-kb",
+        metavar="<n,...>",
+        type=sizes,
+        default=[0, 512],
+        help="Minimal sizes of the programs in KiB, reached by padding them "
+        "with declarations (default: 0,512)",
+    )
+    run.add_argument(
+        "--chunk",
+        metavar="<n>",
+        type=int,
+        default=1,
+        help="Statements executed by a thread before the next context switch",
+    )
+    run.add_argument("--repeat", metavar="<n>", type=int, default=1)
+    run.add_argument(
+        "--keep",
+        metavar="<dir>",
+        type=str,
+        default=None,
+        help="Keep the generated programs, witnesses and reports in <dir>",
+    )
+    add_case_options(run)
+
+    comparison = commands.add_parser("compare", help="Compare two result files")
+    comparison.add_argument("base", metavar="<base.json>", type=str)
+    comparison.add_argument("new", metavar="<new.json>", type=str)
+
+    case = commands.add_parser("case")
+    case.add_argument("program", type=str)
+    case.add_argument("witness", type=str)
+    case.add_argument("report", type=str)
+    add_case_options(case)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.command == "run":
+        run_suite(args)
+    elif args.command == "compare":
+        compare(args)
+    else:
+        run_case(args)
@@ -0,0 +1,152 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "ConcurrentWitness2Test")
+
+
+def digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def stream_digest(chunks):
+    """Returns the digest of the concatenation of the (str) chunks, however
+    they are split."""
+    h = hashlib.sha256()
+    for chunk in chunks:
+        h.update(chunk.encode())
+    return h.hexdigest()
+
+
+def usable_dir(path):
+    """Creates `path` if needed, and tells whether entries can be stored in it."""
+    if not path:
+        return False
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return False
+    return os.access(path, os.W_OK | os.X_OK)
+
+
+class DiskCache:
+    """A directory of files keyed by content hashes, bounded by total size.
+
+    Entries are written to a temporary file and renamed into place, so readers
+    never see partial entries and several processes can share the directory.
+    Every hit refreshes the modification time of the entry, and the least
+    recently used entries are evicted once the directory exceeds `max_size`
+    bytes.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+    def entry(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        path = self.entry(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def read(self, key):
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, src):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        os.close(fd)
+        try:
+            shutil.copy2(src, tmp)
+            os.replace(tmp, self.entry(key))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+        return self.entry(key)
+
+    def write(self, key, data):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.entry(key))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+        return self.entry(key)
+
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total = total + stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total = total - size
+
+
+def open_cache(cache_dir, name, max_size):
+    """Returns the DiskCache `name` inside `cache_dir`, or None if unusable."""
+    if not cache_dir:
+        return None
+    path = os.path.join(cache_dir, name)
+    if not usable_dir(path):
+        return None
+    return DiskCache(path, max_size)
@@ -0,0 +1,104 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import socket
+import struct
+import sys
+import time
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+LENGTH = struct.Struct("I")
+EXIT_CODE = struct.Struct("i")
+
+# A request is the length of its JSON encoding, sent together with the
+# standard output and error of the client (SCM_RIGHTS), then the JSON itself:
+# the command line, the working directory, the environment and the start time.
+# The daemon answers with the exit code once the validation is finished.
+
+
+def receive_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data = data + chunk
+    return data
+
+
+def send_request(sock, request, fds):
+    data = json.dumps(request).encode()
+    socket.send_fds(sock, [LENGTH.pack(len(data))], fds)
+    sock.sendall(data)
+
+
+def receive_request(sock):
+    header, fds, _, _ = socket.recv_fds(sock, LENGTH.size, 2)
+    rest = receive_exactly(sock, LENGTH.size - len(header))
+    if len(fds) != 2 or rest is None:
+        raise ConnectionError("Malformed request")
+    data = receive_exactly(sock, LENGTH.unpack(header + rest)[0])
+    if data is None:
+        raise ConnectionError("Malformed request")
+    return json.loads(data), fds
+
+
+def connect(path):
+    """Returns a connection to the daemon listening on path, or None."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def validate(sock, argv, start_time):
+    """Lets the daemon validate with the given command line, writing to our
+    standard output and error. Returns the exit code."""
+    with sock:
+        request = {
+            "argv": argv,
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+            # CLOCK_MONOTONIC is shared by the processes of the machine, so
+            # the --timeout budget of the daemon starts when we did
+            "start_time": start_time,
+        }
+        send_request(sock, request, [sys.stdout.fileno(), sys.stderr.fileno()])
+        data = receive_exactly(sock, EXIT_CODE.size)
+    if data is None:
+        raise ConnectionError("The daemon terminated unexpectedly")
+    return EXIT_CODE.unpack(data)[0]
+
+
+if __name__ == "__main__":
+    start_time = time.monotonic()
+    path = os.environ.get("C2TT_DAEMON")
+    sock = connect(path) if path else None
+    if sock is None:
+        # no daemon: validate in a fresh interpreter, as without the client
+        os.execv(sys.executable, [sys.executable, MAIN, *sys.argv[1:]])
+    try:
+        code = validate(sock, sys.argv[1:], start_time)
+    except OSError as e:
+        print(e, file=sys.stderr)
+        print("Verdict: Unknown error")
+        code = -1
+    sys.exit(code)
@@ -0,0 +1,156 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from functools import lru_cache
+
+from cache import DEFAULT_CACHE_SIZE, digest, open_cache, stream_digest, usable_dir
+
+CC = "gcc"
+CFLAGS = ["-w", "-Wno-implicit-function-declaration"]
+HARNESS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "svcomp.c")
+# synchronization backends of the harness
+SYNC_FLAGS = {"futex": [], "mutex": ["-DC2TT_SYNC_MUTEX"]}
+# the deterministic replay of the harness, see C2TT_REPLAY in svcomp.c
+REPLAY_FLAGS = [
+    "-DC2TT_REPLAY",
+    "-Wl,--wrap=pthread_create,--wrap=pthread_join,--wrap=pthread_exit,"
+    "--wrap=pthread_mutex_lock",
+]
+
+
+@lru_cache(maxsize=None)
+def compiler_version():
+    result = subprocess.run(
+        [CC, "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    machine = subprocess.run(
+        [CC, "-dumpmachine"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    return result.stdout + machine.stdout
+
+
+def harness_object(cache_dir, flags=CFLAGS):
+    """Returns the compiled svcomp.c from the cache, building it if needed.
+
+    The object is keyed by the harness source, the compiler and the flags, and
+    is moved into place atomically, so concurrent validations can share it.
+    """
+    with open(HARNESS, "rb") as f:
+        source = f.read()
+    key = digest(source, compiler_version(), "\0".join(flags))
+    path = os.path.join(cache_dir, f"svcomp-{key}.o")
+    if os.path.exists(path):
+        return path
+    fd, tmp = tempfile.mkstemp(suffix=".o", dir=cache_dir)
+    os.close(fd)
+    try:
+        result = subprocess.run(
+            [CC, *flags, "-c", HARNESS, "-o", tmp],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if result.returncode != 0:
+            return None
+        os.replace(tmp, path)
+        return path
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def write_chunks(fd, chunks):
+    try:
+        with open(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk.encode())
+    except BrokenPipeError:
+        # the compiler exited early; its exit code tells why
+        pass
+
+
+def run_compiler(command, chunks):
+    """Runs the compiler, writing the chunks to its standard input one by one
+    (from a thread, so that its output cannot block it)."""
+    read_fd, write_fd = os.pipe()
+    try:
+        process = subprocess.Popen(
+            command, stdin=read_fd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except BaseException:
+        os.close(write_fd)
+        raise
+    finally:
+        os.close(read_fd)
+    writer = threading.Thread(target=write_chunks, args=(write_fd, chunks))
+    writer.start()
+    stdout, stderr = process.communicate()
+    writer.join()
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+def compile_test(
+    source,
+    bin_name,
+    cache_dir=None,
+    cache_size=DEFAULT_CACHE_SIZE,
+    sync="futex",
+    replay=False,
+):
+    """Compiles the C source (a string, or an iterable of string chunks) into
+    bin_name, unless it was compiled before.
+
+    The source is passed to the compiler on its standard input. Binaries are
+    cached by the generated source, the harness and the compiler command line.
+    """
+    flags = CFLAGS + SYNC_FLAGS[sync] + (REPLAY_FLAGS if replay else [])
+    chunks = [source] if isinstance(source, str) else source
+    binaries = open_cache(cache_dir, "binaries", cache_size)
+    key = None
+    if binaries is not None:
+        with open(HARNESS, "rb") as f:
+            harness_source = f.read()
+        key = digest(
+            stream_digest(chunks), harness_source, compiler_version(), CC, *flags
+        )
+        cached = binaries.get(key)
+        if cached is not None:
+            try:
+                shutil.copy2(cached, bin_name)
+                print("Using cached binary")
+                return subprocess.CompletedProcess([CC], 0, b"", b"")
+            except OSError:
+                pass
+
+    harness = HARNESS
+    if usable_dir(cache_dir):
+        try:
+            harness = harness_object(cache_dir, flags) or HARNESS
+        except OSError:
+            harness = HARNESS
+    result = run_compiler(
+        [CC, *flags, "-x", "c", "-", "-x", "none", harness, "-o", bin_name], chunks
+    )
+    if result.returncode == 0 and binaries is not None:
+        try:
+            binaries.put(key, bin_name)
+        except OSError:
+            pass
+    return result
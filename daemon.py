@@ -0,0 +1,163 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+import traceback
+
+from client import EXIT_CODE, connect, receive_request
+from compiler import compiler_version
+import main
+
+
+def warm_up():
+    """Loads what every validation needs, before the first client forks."""
+    main.shared_parser()
+    compiler_version()
+
+
+def exit_on_hangup(conn, done):
+    """Interrupts the validation, killing its test executions, if the client
+    goes away (e.g. because it was killed on a timeout)."""
+
+    def watch():
+        try:
+            hangup = not conn.recv(1)
+        except OSError:
+            hangup = True
+        if hangup and not done.is_set():
+            os.kill(os.getpid(), signal.SIGINT)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def run_main(argv, start_time):
+    """Runs the command line of main.py, returns its exit code."""
+    sys.argv = ["main.py", *argv]
+    try:
+        main.main(argv, start_time)
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except OSError:
+            pass
+
+
+def serve_client(conn):
+    """Validates the request of a client in a child forked for the connection,
+    writing to the standard output and error of the client."""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    request, fds = receive_request(conn)
+    os.dup2(fds[0], sys.stdout.fileno())
+    os.dup2(fds[1], sys.stderr.fileno())
+    for fd in fds:
+        os.close(fd)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    done = threading.Event()
+    exit_on_hangup(conn, done)
+    code = run_main(request["argv"], request["start_time"])
+    done.set()
+    try:
+        conn.sendall(EXIT_CODE.pack(code))
+    except BrokenPipeError:
+        pass
+
+
+def remove_stale_socket(path):
+    if not os.path.exists(path) or not stat.S_ISSOCK(os.stat(path).st_mode):
+        return
+    sock = connect(path)
+    if sock is not None:
+        sock.close()
+        sys.exit(f"A daemon is already listening on {path}")
+    os.remove(path)
+
+
+def serve(path):
+    """Accepts clients until interrupted, forking a child for each of them.
+
+    The children share the imports, the parser tables and the in-memory
+    caches (e.g. the compiler version) of the daemon, and they cannot affect
+    each other or the daemon.
+    """
+    warm_up()
+    remove_stale_socket(path)
+    # the children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        try:
+            server.listen()
+            print(f"Listening on {path}", flush=True)
+            while True:
+                conn, _ = server.accept()
+                pid = os.fork()
+                if pid == 0:
+                    code = 0
+                    try:
+                        server.close()
+                        serve_client(conn)
+                    except BaseException:
+                        traceback.print_exc()
+                        code = 1
+                    finally:
+                        os._exit(code)
+                conn.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Serve the validations of client.py from a resident process"
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="<path>",
+        type=str,
+        default=os.environ.get("C2TT_DAEMON"),
+        required="C2TT_DAEMON" not in os.environ,
+        help="Unix domain socket to listen on (default: $C2TT_DAEMON)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    serve(parse_arguments().socket)
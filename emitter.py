@@ -0,0 +1,186 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+
+from pycparser.c_ast import FuncDef, Pragma
+from pycparser.c_generator import CGenerator
+
+# line markers (e.g., # 1 "file.c") make the coordinates refer to other files
+LINE_MARKER = re.compile(r"^[ \t]*#[ \t]*(?:line[ \t]+)?\d", re.M)
+TOKEN = re.compile(r"[;{}()\[\]]|\"(?:[^\"\\\n]|\\.)*\"?|'(?:[^'\\\n]|\\.)*'?")
+OPENING = "{(["
+CLOSING = "})]"
+
+
+def offset_of(coord, starts):
+    if coord is None or not coord.line or coord.line > len(starts):
+        return None
+    return starts[coord.line - 1] + max(coord.column or 1, 1) - 1
+
+
+def on_line(offset, line, starts):
+    return starts[line - 1] <= offset and (line == len(starts) or offset < starts[line])
+
+
+def end_of(node, source, starts):
+    """Returns the end of the text of a top-level node (after its closing
+    brace or semicolon), or None if it cannot be found."""
+    start = offset_of(node.coord, starts)
+    if start is None:
+        return None
+    if isinstance(node, Pragma):
+        end = source.find("\n", start)
+        return len(source) if end < 0 else end
+    if isinstance(node, FuncDef):
+        # the body is the first brace after the name (the column of its
+        # coordinate is not reliable, only its line)
+        line = node.body.coord.line if node.body.coord else None
+        depth = 0
+        for m in TOKEN.finditer(source, start):
+            token = m.group()
+            if token == "{":
+                if depth == 0 and (
+                    line is None or not on_line(m.start(), line, starts)
+                ):
+                    return None
+                depth = depth + 1
+            elif token == "}":
+                depth = depth - 1
+                if depth == 0:
+                    return m.end()
+        return None
+    # the coordinate of a declaration is its name, which may be nested in
+    # parentheses or brackets (e.g., int (*f)(int);), hence depth <= 0
+    depth = 0
+    for m in TOKEN.finditer(source, start):
+        token = m.group()
+        if token in OPENING:
+            depth = depth + 1
+        elif token in CLOSING:
+            depth = depth - 1
+        elif token == ";" and depth <= 0:
+            return m.end()
+    return None
+
+
+class SourceText:
+    """Locates the text of the top-level nodes in the source they were parsed
+    from, on demand (after pruning, only the remaining nodes are located).
+
+    A node spans from the end of the previous one to its own end, including
+    the whitespace (comments are blanked by the normalizer) before it. Nodes
+    declared together (e.g., int a, b;) share their text.
+    """
+
+    def __init__(self, ast, source):
+        self.source = source
+        self.nodes = list(ast.ext)
+        self.indices = {node: i for i, node in enumerate(self.nodes)}
+        self.starts = [0]
+        self.starts.extend(m.end() for m in re.finditer("\n", source))
+        self.ends = {}
+
+    def end(self, i):
+        if i not in self.ends:
+            self.ends[i] = end_of(self.nodes[i], self.source, self.starts)
+        return self.ends[i]
+
+    def locate(self, node):
+        """Returns the (start, end, nodes) text of the node and the nodes
+        sharing it, or None if it cannot be located."""
+        i = self.indices.get(node)
+        if i is None or self.end(i) is None:
+            return None
+        end = self.end(i)
+        first = i
+        while first > 0 and self.end(first - 1) == end:
+            first = first - 1
+        last = i
+        while last + 1 < len(self.nodes) and self.end(last + 1) == end:
+            last = last + 1
+        start = self.end(first - 1) if first > 0 else 0
+        if start is None or start >= end:
+            return None
+        nodes = self.nodes[first : last + 1]
+        for member in nodes:
+            offset = offset_of(member.coord, self.starts)
+            if offset is None or not start <= offset < end:
+                return None
+        return start, end, nodes
+
+
+def source_text(ast, source):
+    """Returns the SourceText of the AST, or None if its coordinates do not
+    refer to the source."""
+    if source is None or LINE_MARKER.search(source):
+        return None
+    return SourceText(ast, source)
+
+
+class SplicedSource:
+    """The C source of a (modified) AST, as a sequence of chunks.
+
+    The text of the top-level nodes that are not modified is copied from the
+    source, and only the others are generated. Copied chunks are only sliced
+    from the source while iterating, so the whole text is never built.
+    """
+
+    def __init__(self, ast, text, modified):
+        self.source = text.source if text is not None else None
+        self.parts = []
+        self.copied = 0
+        self.generated = 0
+        generator = CGenerator()
+        ext = ast.ext
+        i = 0
+        while i < len(ext):
+            node = ext[i]
+            span = None
+            if text is not None and node not in modified:
+                span = text.locate(node)
+            if span is not None:
+                start, end, nodes = span
+                group = ext[i : i + len(nodes)]
+                if all(a is b and a not in modified for a, b in zip(group, nodes)):
+                    self.parts.append((start, end))
+                    self.copied = self.copied + end - start
+                    i = i + len(nodes)
+                    continue
+            # the same separators as CGenerator.visit_FileAST
+            code = generator.visit(node)
+            if isinstance(node, Pragma):
+                code = code + "\n"
+            elif not isinstance(node, FuncDef):
+                code = code + ";\n"
+            self.parts.append("\n" + code)
+            self.generated = self.generated + len(code) + 1
+            i = i + 1
+        self.parts.append("\n")
+
+    @property
+    def spliced(self):
+        return self.copied > 0
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, str):
+                yield part
+            else:
+                yield self.source[part[0] : part[1]]
+
+    def __len__(self):
+        return self.copied + self.generated + 1
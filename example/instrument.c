@@ -0,0 +1,46 @@
+int __VERIFIER_nondet_int(void);
+int x, y, z;
+void *worker(void *arg) {
+  int a;
+  a = __VERIFIER_nondet_int();
+  {
+    x = 1;
+    {
+      y = 1;
+    }
+  }
+  z = a;
+  while (x < 3) {
+    if (y) {
+      switch (x) {
+      case 1:
+        y = 2;
+        break;
+      default:
+        y = 3;
+      }
+    } else
+      x = x + 1;
+    x = x + 1;
+  }
+  for (a = 0; a < 2; a++)
+    z = z + a;
+  do {
+    y = y - 1;
+  } while (y > 0);
+  return 0;
+}
+int main(void) {
+  int b;
+  b = __VERIFIER_nondet_int();
+  x = 0;
+  if (b) {
+    y = 1;
+  } else {
+    y = 2;
+  }
+  z = 3;
+  z = 4;
+  worker(0);
+  return 0;
+}
@@ -0,0 +1,26 @@
+// GNU extensions removed before parsing, see normalizer.py
+typedef __builtin_va_list __gnuc_va_list;
+__extension__ typedef signed long long int __int64_t;
+__extension__ typedef unsigned long long int __uint64_t;
+typedef __signed__ char __s8;
+/* a comment */ typedef int __pid_t;
+extern int fprintf (void *__restrict __stream, const char *__restrict __format, ...);
+extern int fscanf (void *__restrict __stream, const char *__restrict __format, ...) __asm__ ("" "__isoc99_fscanf");
+extern void *malloc (unsigned long __size) __attribute__ ((__nothrow__ , __leaf__)) __attribute__ ((__malloc__)) ;
+extern void abort (void) __attribute__ ((__nothrow__ , __leaf__)) __attribute__ ((__noreturn__));
+extern int atoi (const char *__nptr)
+     __attribute__ ((__nothrow__ , __leaf__)) __attribute__ ((__pure__)) __attribute__ ((__nonnull__ (1))) ;
+static __inline unsigned int
+__bswap_32 (unsigned int __bsx)
+{
+  return __builtin_bswap32 (__bsx);
+}
+struct __attribute__ ((__packed__)) packed { char c; int i; };
+int main(void)
+{
+  int x = __extension__ ({ int __t = 1; __t + 1; });
+  int y = ({ int __u = 2; __u; });
+  asm volatile ("nop");
+  asm ("nop");
+  return x + y; /* done */
+}
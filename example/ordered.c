@@ -0,0 +1,39 @@
+typedef unsigned long int pthread_t;
+union pthread_attr_t { char __size[56]; long int __align; };
+typedef union pthread_attr_t pthread_attr_t;
+extern int pthread_create (pthread_t *__restrict __newthread, const pthread_attr_t *__restrict __attr, void *(*__start_routine) (void *), void *__restrict __arg) __attribute__ ((__nothrow__)) __attribute__ ((__nonnull__ (1, 3)));
+extern int pthread_join (pthread_t __th, void **__thread_return);
+extern void abort (void) __attribute__ ((__nothrow__ , __leaf__)) __attribute__ ((__noreturn__));
+void reach_error() { abort(); }
+int shared = 0;
+void *thread1(void *arg)
+{
+  int value = 0;
+  value = value + 0;
+  value = value + 1;
+  value = value + 2;
+  value = value + 3;
+  shared = shared + value;
+  return 0;
+}
+void *thread2(void *arg)
+{
+  int value = 0;
+  value = value + 0;
+  value = value + 1;
+  value = value + 2;
+  value = value + 3;
+  shared = shared + value;
+  return 0;
+}
+int main()
+{
+  pthread_t t1;
+  pthread_t t2;
+  pthread_create(&t1, 0, thread1, 0);
+  pthread_create(&t2, 0, thread2, 0);
+  pthread_join(t1, 0);
+  pthread_join(t2, 0);
+  if (shared == 12) reach_error();
+  return 0;
+}
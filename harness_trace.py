@@ -0,0 +1,108 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import struct
+from collections import namedtuple
+
+# See struct c2tt_trace and struct c2tt_event in svcomp.c
+MAGIC = b"C2TT"
+HEADER = struct.Struct("=4sIII")
+EVENT = struct.Struct("=QihH")
+
+PAUSED = 1
+RESUMED = 2
+RELEASED = 3
+REACHED_ERROR = 4
+FELL_BACK = 5
+
+Event = namedtuple("Event", ["time", "step", "thread", "kind"])
+Summary = namedtuple(
+    "Summary",
+    ["events", "step", "waiting", "reached_error", "fell_back", "peak_rss_kib"],
+)
+
+
+def decode(data):
+    """Returns the events of a trace file in the order they were recorded.
+
+    Only the last `capacity` events are kept by the ring buffer; events that
+    were not completely written (e.g., the run was killed) are skipped.
+    """
+    if len(data) < HEADER.size:
+        return []
+    magic, capacity, count, _ = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        return []
+    first = max(0, count - capacity)
+    events = []
+    for n in range(first, count):
+        offset = HEADER.size + (n % capacity) * EVENT.size
+        if offset + EVENT.size > len(data):
+            break
+        event = Event(*EVENT.unpack_from(data, offset))
+        if event.kind != 0:
+            events.append(event)
+    return events
+
+
+def peak_rss(data):
+    """Returns the peak RSS (KiB) recorded by the run, or None if it did not
+    record it (e.g., it was killed)."""
+    if len(data) < HEADER.size:
+        return None
+    magic, _, _, peak_rss_kib = HEADER.unpack_from(data)
+    if magic != MAGIC or not peak_rss_kib:
+        return None
+    return peak_rss_kib
+
+
+def summarize(events, peak_rss_kib=None):
+    """Tells how far the schedule got: the last step released, and the
+    threads still waiting (thread id -> step) at the end of the run, and
+    whether a replay fell back to free scheduling."""
+    step = 0
+    waiting = {}
+    reached_error = False
+    fell_back = False
+    for event in events:
+        if event.kind == RELEASED:
+            step = max(step, event.step)
+        elif event.kind == PAUSED:
+            waiting[event.thread] = event.step
+        elif event.kind == RESUMED:
+            waiting.pop(event.thread, None)
+        elif event.kind == REACHED_ERROR:
+            reached_error = True
+        elif event.kind == FELL_BACK:
+            fell_back = True
+    return Summary(len(events), step, waiting, reached_error, fell_back, peak_rss_kib)
+
+
+def describe(summary):
+    waiting = ", ".join(
+        f"thread {thread} for step {step}"
+        for thread, step in sorted(summary.waiting.items())
+    )
+    text = f"Schedule reached step {summary.step} ({summary.events} events)"
+    if summary.fell_back:
+        text = text + ", replay fell back to free scheduling"
+    return text + (", waiting: " + waiting if waiting else "")
+
+
+def read_summary(f):
+    f.seek(0)
+    data = f.read()
+    return summarize(decode(data), peak_rss(data))
@@ -15,177 +15,420 @@ limitations under the License.
 """
 
 import os
-import re
-import subprocess
+import pickle
 import sys
 import tempfile
+import time
 import traceback
 import argparse
+import json
+import zlib
+from contextlib import nullcontext
 
-from pycparser import parse_file, c_generator
+import pycparser
 
 from Exceptions import KnownErrorVerdict
-from tweaks import reach_error, fix_inline, fix_struct_def
+from tweaks import reach_error, fix_inline, fix_struct_def, remove_unused, descendants
+from emitter import SplicedSource, source_text
 from witness2ast import apply_witness
+from normalizer import normalize
+from runner import (
+    run_tests,
+    run_limits,
+    default_jobs,
+    MODES,
+    DEFAULT_CONFIDENCE,
+    DEFAULT_MIN_RATE,
+)
+from compiler import compile_test, SYNC_FLAGS
+from cache import default_cache_dir, digest, open_cache, DEFAULT_CACHE_SIZE
+from parser_tables import new_parser
+import profiling
 
+# the parser of the process; building it is expensive, so it is shared by every
+# validation (e.g. of a batch or of the daemon), and only built on a cache miss
+c_parser = None
 
-def translate_to_c(filename, witness, mode):
-    """Simply use the c_generator module to emit a parsed AST."""
+
+def shared_parser():
+    global c_parser
+    if c_parser is None:
+        c_parser = new_parser()
+    return c_parser
+
+
+def load_ast(content, cache):
     try:
-        ast = parse_file(filename, use_cpp=False)
-    except KnownErrorVerdict as e:
-        print("Verdict: " + e.verdict)
-        sys.exit(-1)
-    except:
+        data = cache.read(digest(content, pycparser.__version__))
+        return pickle.loads(zlib.decompress(data)) if data else None
+    except Exception:
         traceback.print_exc()
-        print("Verdict: Parsing failed")
-        sys.exit(-1)
+        return None
+
 
+def store_ast(content, cache, ast):
     try:
-        apply_witness(ast, filename, witness)
-    except KnownErrorVerdict as e:
-        print("Verdict: " + e.verdict)
-        sys.exit(-1)
-    except:
+        data = zlib.compress(pickle.dumps(ast, pickle.HIGHEST_PROTOCOL), 1)
+        cache.write(digest(content, pycparser.__version__), data)
+    except (OSError, RecursionError, pickle.PicklingError):
         traceback.print_exc()
-        print("Verdict: Incompatible witness")
-        sys.exit(-1)
 
+
+def parse(content, filename, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE):
+    """Parses the (already normalized) source, reusing a cached AST if possible.
+
+    ASTs are cached by the normalized source and the pycparser version.
+    """
+    try:
+        with profiling.phase("parse"):
+            ast = None
+            cache = open_cache(cache_dir, "asts", cache_size)
+            if cache is not None:
+                ast = load_ast(content, cache)
+            if ast is None:
+                ast = shared_parser().parse(content, filename)
+                if cache is not None:
+                    store_ast(content, cache, ast)
+        if profiling.enabled():
+            profiling.count("ast_nodes", sum(1 for _ in descendants(ast)))
+        return ast
+    except KnownErrorVerdict:
+        raise
+    except Exception:
+        traceback.print_exc()
+        raise KnownErrorVerdict("Parsing failed")
+
+
+def instrument(ast, content, witness):
+    """Applies the witness to the AST, returns the lines it points at, the
+    top-level nodes it modified and whether it is fully ordered."""
+    try:
+        return apply_witness(ast, content, witness)
+    except KnownErrorVerdict:
+        raise
+    except Exception:
+        traceback.print_exc()
+        raise KnownErrorVerdict("Incompatible witness")
+
+
+def verdict_of(codes):
+    may_not = 0 in codes
+    may = -1 in codes
+    if may_not and may:
+        return "SOMETIMES"
+    elif may_not:
+        return "NEVER"
+    elif may:
+        return "ALWAYS"
+    else:
+        return "TIMEOUT"
+
+
+def artifacts_dir(keep_artifacts):
+    """Returns a new directory in keep_artifacts for the files of a validation,
+    or None if they are not kept."""
+    if keep_artifacts is None:
+        return None
+    os.makedirs(keep_artifacts, exist_ok=True)
+    path = tempfile.mkdtemp(prefix="c2tt-", dir=keep_artifacts)
+    print("Keeping artifacts in " + path)
+    return path
+
+
+def keep_artifact(artifacts, name, content):
+    if artifacts is not None:
+        with open(os.path.join(artifacts, name), "w") as f:
+            f.writelines([content] if isinstance(content, str) else content)
+
+
+def run_test(
+    ast,
+    mode,
+    cache_dir=None,
+    cache_size=DEFAULT_CACHE_SIZE,
+    artifacts=None,
+    keep_lines=(),
+    source=None,
+    modified=(),
+    ordered=False,
+    sync="futex",
+    replay=False,
+    **run_options,
+):
+    """Emits, compiles and executes the instrumented AST, returns the verdict
+    (in mode "all", the verdict of each mode, from the same executions).
+
+    If the source the AST was parsed from is given, only the modified
+    top-level nodes are generated, and the others are copied from the source.
+    The code is compiled from memory; only the binary is written to a
+    temporary directory, which is removed afterwards unless the artifacts are
+    kept. With `replay`, a fully `ordered` witness is replayed once
+    deterministically, instead of executing the test repeatedly.
+    """
+    replay = replay and ordered
     try:
-        fix_inline(ast)
-        fix_struct_def(ast)
-        reach_error(ast)
-        generator = c_generator.CGenerator()
-        with tempfile.NamedTemporaryFile(suffix=".c", delete=False) as tmp:
-            tmp.write(generator.visit(ast).encode())
-            tmp.flush()
-            print(tmp.name)
-            bin_name = tmp.name[:-2]
+        text = None
+        # None stands for an unknown modified node
+        if None not in modified:
+            text = source_text(ast, source)
+        with profiling.phase("tweaks"):
+            modified = set(modified)
+            remove_unused(ast, keep_lines)
+            modified.update(fix_inline(ast))
+            modified.update(fix_struct_def(ast))
+            reach_error(ast)
+        profiling.count("top_level_nodes", len(ast.ext))
+        with profiling.phase("generate"):
+            code = SplicedSource(ast, text, modified)
+        profiling.count("generated_bytes", code.generated)
+        profiling.count("copied_bytes", code.copied)
+        keep_artifact(artifacts, "test.c", code)
+        if artifacts is None:
+            workdir = tempfile.TemporaryDirectory(prefix="c2tt-")
+        else:
+            workdir = nullcontext(artifacts)
+        with workdir as path:
+            bin_name = os.path.join(path, "test")
             print("Compilation started")
-            result = subprocess.run(
-                [
-                    "gcc",
-                    "-w",
-                    "-Wno-implicit-function-declaration",
-                    tmp.name,
-                    os.path.dirname(__file__) + os.sep + "svcomp.c",
-                    "-o",
-                    bin_name,
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
+            with profiling.phase("compile", python=False):
+                result = compile_test(
+                    code, bin_name, cache_dir, cache_size, sync, replay
+                )
+            if result.returncode != 0 and code.spliced:
+                # the copied text may be at fault: compile the generated code
+                print("Compiling the generated code without copied source text")
+                with profiling.phase("generate"):
+                    code = SplicedSource(ast, None, modified)
+                keep_artifact(artifacts, "test.c", code)
+                with profiling.phase("compile", python=False):
+                    result = compile_test(
+                        code, bin_name, cache_dir, cache_size, sync, replay
+                    )
             if result.stdout:
                 print(result.stdout.decode())
             if result.stderr:
                 print(result.stderr.decode())
             print(f"Compilation ended (exit code {result.returncode})")
             if result.returncode != 0:
-                print("Verdict: Compilation error")
-                sys.exit(-1)
-            codes = {}
-            for i in range(100):
-                try:
-                    result = subprocess.run([bin_name], capture_output=True, text=True)
-                    print("Execution started")
-                    reached_error = result.returncode == 74
-                    if not reached_error and result.stdout:
-                        for line in result.stdout.split("\n"):
-                            if "Reached error!" in line:
-                                reached_error = True
-                                break
-                    if result.stdout:
-                        print(result.stdout)
-                    if result.stderr:
-                        print(result.stderr)
-                    print(f"Execution ended (exit code {result.returncode})")
-                    code = -1 if reached_error else 0
-                    codes[code] = codes[code] + 1 if code in codes else 1
-                    if mode == "strict" and not reached_error:
-                        break
-                    if mode == "permissive" and reached_error:
-                        break
-                except subprocess.TimeoutExpired:
-                    print(f"Execution ended (timeout)")
-
-            try:
-                os.remove(bin_name)
-            except:
-                traceback.print_exc()
-
-            print(codes)
-            may_not = False
-            may = False
-            if 0 in codes:
-                may_not = True
-            if -1 in codes:
-                may = True
-            if may_not and may:
-                print("Verdict: SOMETIMES")
-            elif may_not:
-                print("Verdict: NEVER")
-            elif may:
-                print("Verdict: ALWAYS")
-            else:
-                print("Verdict: TIMEOUT")
-    except:
+                raise KnownErrorVerdict("Compilation error")
+            modes = MODES if mode == "all" else (mode,)
+            with profiling.phase("run", python=False):
+                results = run_tests(bin_name, modes, replay=replay, **run_options)
+
+            verdicts = {}
+            for each, (codes, rate) in results.items():
+                prefix = f"{each}: " if mode == "all" else ""
+                print(f"{prefix}{codes} {rate.describe()}")
+                verdicts[each] = verdict_of(codes)
+            return verdicts if mode == "all" else verdicts[mode]
+    except KnownErrorVerdict:
+        raise
+    except Exception:
         traceback.print_exc()
-        print("Verdict: Unknown error")
-        sys.exit(-1)
+        raise KnownErrorVerdict("Unknown error")
 
 
-def hacks(content):
-    def replace_with_spaces_str(match_str, offset=0):
-        parens = 0
-        for i, c in enumerate(match_str):
-            if c == "(":
-                parens = parens + 1
-            elif c == ")":
-                parens = parens - 1
-                if parens < 0:
-                    return " " * (i - offset) + match_str[i:]
-                elif parens == 0:
-                    return " " * (i - offset + 1) + match_str[i + 1 :]
-        return " " * (len(match_str) - offset)
-
-    def replace_with_spaces(match):
-        return replace_with_spaces_str(str(match.group(0)))
-
-    def replace_with_zero_padded(match):
-        return "0" + replace_with_spaces_str(str(match.group(0)), 1)
-
-    last_content = ""
-    while last_content != content:
-        last_content = content
-        content = re.sub(r"//[^\n]*", replace_with_spaces, content)
-        content = re.sub(r"/\*.*\*/", replace_with_spaces, content)
-        content = re.sub(r"__attribute__[ \r\n]*\(.*\)", replace_with_spaces, content)
-        content = re.sub(r"__asm__[ \r\n]*\(.*\)", replace_with_spaces, content)
-        content = re.sub(r"asm volatile[ \r\n]*\(.*\)", replace_with_spaces, content)
-        content = re.sub(r"asm[ \r\n]*\(.*\)", replace_with_spaces, content)
-        content = re.sub(
-            r"__extension__[ \r\n]*\(.*\)", replace_with_zero_padded, content
+def translate_to_c(content, filename, witness, mode, keep_artifacts=None, **options):
+    """Simply use the c_generator module to emit a parsed AST."""
+    try:
+        artifacts = artifacts_dir(keep_artifacts)
+        keep_artifact(artifacts, "input.c", content)
+        ast = parse(
+            content,
+            filename,
+            options.get("cache_dir"),
+            options.get("cache_size", DEFAULT_CACHE_SIZE),
         )
-        content = re.sub(r"__extension__", replace_with_spaces, content)
-        content = re.sub(r"__inline", replace_with_spaces, content)
-        content = re.sub(r"__restrict", replace_with_spaces, content)
-        content = re.sub(r"__builtin_va_list", "int              ", content)
-        content = re.sub(r"__signed__", "  signed  ", content)
-        content = re.sub(
-            r"\([ \r\n]*\{.*}[ \r\n]*\)", replace_with_zero_padded, content
+        lines, modified, ordered = instrument(ast, content, witness)
+        verdict = run_test(
+            ast,
+            mode,
+            artifacts=artifacts,
+            keep_lines=lines,
+            source=content,
+            modified=modified,
+            ordered=ordered,
+            **options,
         )
-    return content
+    except KnownErrorVerdict as e:
+        print_verdict(mode, e.verdict)
+        sys.exit(-1)
+    print_verdict(mode, verdict)
+
+
+def verdicts_of(verdict):
+    """Returns the verdicts of mode "all" (the same error verdict for every
+    mode if the validation failed)."""
+    return {each: verdict for each in MODES} if isinstance(verdict, str) else verdict
+
+
+def print_verdict(mode, verdict):
+    if mode == "all":
+        print("Verdicts: " + json.dumps(verdicts_of(verdict)))
+    else:
+        print("Verdict: " + verdict)
 
 
 def perform_hacks(filename, func):
-    with open(filename, "r") as f:
-        with tempfile.NamedTemporaryFile(suffix=".c", delete=False) as tmp:
-            tmp.write(hacks(f.read()).encode())
-            tmp.flush()
-            func(tmp.name)
+    with profiling.phase("normalize"):
+        with open(filename, "r") as f:
+            content = normalize(f.read())
+    func(content)
+
+
+def probability(text):
+    value = float(text)
+    if not 0 <= value < 1:
+        raise argparse.ArgumentTypeError(f"{text} is not in [0, 1)")
+    return value
+
+
+def add_options(parser):
+    """Adds the options shared by the single and the batch entry points."""
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        metavar="<n>",
+        type=int,
+        default=default_jobs(),
+        help="Number of test executions to run in parallel (default: available cores)",
+    )
+    parser.add_argument(
+        "--timeout",
+        metavar="<seconds>",
+        type=float,
+        default=None,
+        help="Time budget of the whole validation; runs that do not fit are skipped",
+    )
+    parser.add_argument(
+        "--run-timeout",
+        metavar="<seconds>",
+        type=float,
+        default=None,
+        help="Time limit of a single test execution",
+    )
+    parser.add_argument(
+        "--run-memory",
+        metavar="<MiB>",
+        type=int,
+        default=None,
+        help="Address space limit of a single test execution",
+    )
+    parser.add_argument(
+        "--run-cpu",
+        metavar="<seconds>",
+        type=int,
+        default=None,
+        help="CPU time limit of a single test execution (exceeding it counts as a timeout)",
+    )
+    parser.add_argument(
+        "--run-processes",
+        metavar="<n>",
+        type=int,
+        default=None,
+        help="Limit of the processes of the user while a test execution runs "
+        "(RLIMIT_NPROC, not enforced for root)",
+    )
+    parser.add_argument(
+        "--confidence",
+        metavar="<c>",
+        type=probability,
+        default=DEFAULT_CONFIDENCE,
+        help="Confidence of the reach rate estimated in normal mode "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--min-rate",
+        metavar="<rate>",
+        type=probability,
+        default=DEFAULT_MIN_RATE,
+        help="In normal mode, stop once the rate of reaching (or of not reaching) "
+        "the error is below <rate> with the given confidence; 0 runs every "
+        "execution (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fork-server",
+        action="store_true",
+        help="Start the test once and fork it before main for every execution",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="If the witness orders every step, replay it once deterministically "
+        "instead of executing the test repeatedly",
+    )
+    parser.add_argument(
+        "--verbose-trace",
+        action="store_true",
+        help="Let the harness print every synchronization event of the test",
+    )
+    parser.add_argument(
+        "--sync",
+        choices=sorted(SYNC_FLAGS),
+        default="futex",
+        help="Synchronization backend of the test harness (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="<dir>",
+        type=str,
+        default=default_cache_dir(),
+        help="Directory of the caches (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use or populate the caches",
+    )
+    parser.add_argument(
+        "--cache-size",
+        metavar="<MiB>",
+        type=int,
+        default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+        help="Size limit of each cache (default: %(default)s MiB)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="<report.json>",
+        type=str,
+        default=None,
+        help="Write the time, memory and counters of each phase to a JSON report",
+    )
+    parser.add_argument(
+        "--profile-python",
+        metavar="<stats.prof>",
+        type=str,
+        default=None,
+        help="With --profile, also write the cProfile statistics of the Python phases",
+    )
+    parser.add_argument(
+        "--keep-artifacts",
+        metavar="<dir>",
+        default=None,
+        help="Keep the normalized input, the generated test and the binary "
+        "in a new directory in <dir>",
+    )
+
+
+def options_of(args, start_time):
+    """Returns the keyword arguments of run_test for the parsed options."""
+    return {
+        "cache_dir": None if args.no_cache else args.cache_dir,
+        "cache_size": args.cache_size * 1024 * 1024,
+        "jobs": args.jobs,
+        "deadline": start_time + args.timeout if args.timeout else None,
+        "run_timeout": args.run_timeout,
+        "limits": run_limits(args.run_memory, args.run_cpu, args.run_processes),
+        "fork_server": args.fork_server,
+        "confidence": args.confidence,
+        "min_rate": args.min_rate,
+        "sync": args.sync,
+        "replay": args.replay,
+        "verbose": args.verbose_trace,
+    }
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(
         description="Parse command line arguments for ConcurrentWitness2Test.py"
     )
@@ -204,16 +447,20 @@ def parse_arguments():
     )
     parser.add_argument(
         "--mode",
-        choices=["strict", "normal", "permissive"],
+        choices=[*MODES, "all"],
         default="normal",
-        help="Mode (default: normal)",
+        help="Mode (default: normal); all decides every mode from the same executions",
     )
+    add_options(parser)
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-if __name__ == "__main__":
-    args = parse_arguments()
+def main(argv=None, start_time=None):
+    """The command line entry point; the daemon calls it for every client."""
+    if start_time is None:
+        start_time = time.monotonic()
+    args = parse_arguments(argv)
 
     if not args.input_file:
         print("Please provide input file.")
@@ -225,4 +472,19 @@ if __name__ == "__main__":
         argparse.ArgumentParser().print_help()
         sys.exit(-1)
 
-    perform_hacks(args.input_file, lambda x: translate_to_c(x, args.witness, args.mode))
+    with profiling.profiled(args.profile, args.profile_python):
+        perform_hacks(
+            args.input_file,
+            lambda x: translate_to_c(
+                x,
+                args.input_file,
+                args.witness,
+                args.mode,
+                args.keep_artifacts,
+                **options_of(args, start_time),
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+
+# GNU extensions pycparser cannot parse. Every replacement has the length of
+# the replaced text and keeps its line breaks, so that the lines and offsets
+# referenced by the witness stay valid.
+
+# removed together with the parenthesized group following them
+GROUP_KEYWORDS = {"__attribute__", "__asm__", "__asm", "asm"}
+ASM_QUALIFIERS = {"volatile", "__volatile__", "goto", "inline"}
+# removed, or replaced by 0 together with the parenthesized group following them
+EXPRESSION_KEYWORDS = {"__extension__"}
+REPLACEMENTS = {
+    "__inline": "",
+    "__inline__": "",
+    "__restrict": "",
+    "__restrict__": "",
+    "__builtin_va_list": "int",
+    "__signed__": "  signed",
+}
+
+TOKEN = re.compile(
+    r"//|/\*|\"|'|\((?=[ \t\r\n]*\{)|\b(asm|__(?:"
+    + "|".join(
+        sorted(
+            word[2:]
+            for word in GROUP_KEYWORDS | EXPRESSION_KEYWORDS | set(REPLACEMENTS)
+            if word.startswith("__")
+        )[::-1]
+    )
+    + r"))\b"
+)
+GROUP_TOKEN = re.compile(r"[()]|//|/\*|\"|'")
+SPACE = re.compile(r"(?:[ \t\r\n]+|//[^\n]*|/\*.*?(?:\*/|\Z))*", re.S)
+WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+LITERALS = {
+    "'": re.compile(r"'(?:[^'\\\n]|\\.)*'?"),
+    '"': re.compile(r'"(?:[^"\\\n]|\\.)*"?'),
+}
+NOT_LINE_BREAK = re.compile(r"[^\r\n]")
+
+
+def blank(text):
+    if "\n" not in text and "\r" not in text:
+        return " " * len(text)
+    return NOT_LINE_BREAK.sub(" ", text)
+
+
+def padded(replacement, text):
+    return replacement + blank(text[len(replacement) :])
+
+
+def skip_comment(content, pos):
+    """Returns the end of the comment starting at pos."""
+    if content.startswith("//", pos):
+        end = content.find("\n", pos)
+    else:
+        end = content.find("*/", pos + 2)
+        end = end + 2 if end >= 0 else -1
+    return end if end >= 0 else len(content)
+
+
+def skip_literal(content, pos):
+    return LITERALS[content[pos]].match(content, pos).end()
+
+
+def group_end(content, pos):
+    """Returns the end of the parenthesized group starting at pos, or None."""
+    depth = 0
+    while True:
+        m = GROUP_TOKEN.search(content, pos)
+        if not m:
+            return None
+        token = m.group()
+        if token == "(":
+            depth = depth + 1
+            pos = m.end()
+        elif token == ")":
+            depth = depth - 1
+            pos = m.end()
+            if depth == 0:
+                return pos
+        elif token in LITERALS:
+            pos = skip_literal(content, m.start())
+        else:
+            pos = skip_comment(content, m.start())
+
+
+def skip_asm_qualifiers(content, pos):
+    while True:
+        pos = SPACE.match(content, pos).end()
+        m = WORD.match(content, pos)
+        if not m or m.group() not in ASM_QUALIFIERS:
+            return pos
+        pos = m.end()
+
+
+def normalize(content):
+    """Removes the GNU extensions pycparser cannot handle in a single pass.
+
+    Comments are blanked, string and character literals are kept as they are,
+    and the keywords above are only recognized as whole words outside of them.
+    """
+    out = []
+    last = 0
+    pos = 0
+    while True:
+        m = TOKEN.search(content, pos)
+        if not m:
+            break
+        start = m.start()
+        token = m.group()
+        end = None
+        replacement = ""
+        if token in LITERALS:
+            pos = skip_literal(content, start)
+            continue
+        elif token in ("//", "/*"):
+            end = skip_comment(content, start)
+        elif token == "(":
+            end = group_end(content, start)
+            replacement = "0"
+        elif token in GROUP_KEYWORDS:
+            paren = SPACE.match(content, m.end()).end()
+            if token != "__attribute__":
+                paren = skip_asm_qualifiers(content, m.end())
+            if content.startswith("(", paren):
+                end = group_end(content, paren)
+        elif token in EXPRESSION_KEYWORDS:
+            paren = SPACE.match(content, m.end()).end()
+            if content.startswith("(", paren):
+                end = group_end(content, paren)
+                replacement = "0"
+            if end is None:
+                end = m.end()
+                replacement = ""
+        else:
+            end = m.end()
+            replacement = REPLACEMENTS[token]
+        if end is None:
+            pos = m.end()
+            continue
+        out.append(content[last:start])
+        out.append(padded(replacement, content[start:end]))
+        last = pos = end
+    out.append(content[last:])
+    return "".join(out)
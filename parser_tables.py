@@ -0,0 +1,61 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import py_compile
+
+TOOL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def table_modules():
+    """Returns the names of the lexer and parser table modules in TOOL_DIR.
+
+    Optimized PLY parsers do not check whether their tables match the grammar,
+    so the tables are named after the pycparser version that generated them.
+    """
+    import pycparser
+
+    version = pycparser.__version__.replace(".", "_")
+    return f"c2tt_lextab_{version}", f"c2tt_yacctab_{version}"
+
+
+def new_parser():
+    """Returns a CParser using the tables pre-generated in TOOL_DIR.
+
+    Missing tables are generated, and written to TOOL_DIR if it is writable
+    (otherwise they are generated again by every process, which takes about
+    half a second).
+    """
+    from pycparser import CParser
+
+    lextab, yacctab = table_modules()
+    return CParser(lextab=lextab, yacctab=yacctab, taboutputdir=TOOL_DIR)
+
+
+if __name__ == "__main__":
+    # generates the tables, e.g. before the tool directory becomes read-only
+    for module in table_modules():
+        path = os.path.join(TOOL_DIR, module + ".py")
+        if os.path.exists(path):
+            os.remove(path)
+    new_parser()
+    for module in table_modules():
+        # the bytecode stays valid when the archive resets the file times
+        py_compile.compile(
+            os.path.join(TOOL_DIR, module + ".py"),
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+            doraise=True,
+        )
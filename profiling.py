@@ -0,0 +1,180 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager, nullcontext
+
+# The profile of the running validation, if any. Every function of this
+# module does nothing while it is None.
+active = None
+
+
+class Profile:
+    """Per-phase wall and CPU time, peak RSS, counters and per-run results, and
+    the startup time of the process (until the profile was started).
+
+    Phases marked as `python` are also recorded by cProfile, if enabled.
+    """
+
+    def __init__(self, python_stats=None):
+        self.start = time.perf_counter()
+        self.startup = process_age()
+        self.phases = []
+        self.counts = {}
+        self.runs = []
+        self.python = None
+        if python_stats:
+            import cProfile
+
+            self.python = cProfile.Profile()
+        self.python_stats = python_stats
+
+    @contextmanager
+    def phase(self, name, python=True):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        children = children_cpu()
+        python = python and self.python is not None
+        if python:
+            self.python.enable()
+        try:
+            yield
+        finally:
+            if python:
+                self.python.disable()
+            self.phases.append(
+                {
+                    "name": name,
+                    "wall": time.perf_counter() - wall,
+                    "cpu": time.process_time() - cpu,
+                    "children_cpu": children_cpu() - children,
+                    "peak_rss_kib": peak_rss(resource.RUSAGE_SELF),
+                }
+            )
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def record_run(self, result):
+        self.runs.append(
+            {
+                "duration": result.duration,
+                "exit_code": result.returncode,
+                "timed_out": result.timed_out,
+                "reached_error": result.reached_error,
+                "user_cpu": result.usage.user if result.usage else None,
+                "system_cpu": result.usage.system if result.usage else None,
+                "peak_rss_kib": result.usage.peak_rss_kib if result.usage else None,
+            }
+        )
+
+    def report(self):
+        totals = {}
+        for phase in self.phases:
+            total = totals.setdefault(
+                phase["name"], {"wall": 0.0, "cpu": 0.0, "children_cpu": 0.0}
+            )
+            for key in total:
+                total[key] = total[key] + phase[key]
+        return {
+            "startup": self.startup,
+            "wall": time.perf_counter() - self.start,
+            "cpu": time.process_time(),
+            "peak_rss_kib": peak_rss(resource.RUSAGE_SELF),
+            "children_peak_rss_kib": peak_rss(resource.RUSAGE_CHILDREN),
+            "phases": self.phases,
+            "totals": totals,
+            "counts": self.counts,
+            "runs": self.runs,
+        }
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        if self.python is not None:
+            self.python.dump_stats(self.python_stats)
+
+
+def process_age():
+    """Returns the time elapsed since the process started (with the resolution
+    of the clock ticks), or None if it is unknown."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            stat = f.read()
+        # the fields following the parenthesized command name start with the
+        # 3rd one, and the start time (in clock ticks after boot) is the 22nd
+        ticks = int(stat[stat.rindex(")") + 2 :].split()[19])
+        boot_time = time.clock_gettime(time.CLOCK_BOOTTIME)
+        return boot_time - ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss(who):
+    return resource.getrusage(who).ru_maxrss
+
+
+def start(python_stats=None):
+    global active
+    active = Profile(python_stats)
+    return active
+
+
+def stop():
+    global active
+    profile, active = active, None
+    return profile
+
+
+def phase(name, python=True):
+    return active.phase(name, python) if active is not None else nullcontext()
+
+
+def enabled():
+    return active is not None
+
+
+def count(name, value):
+    if active is not None:
+        active.count(name, value)
+
+
+def record_run(result):
+    if active is not None:
+        active.record_run(result)
+
+
+@contextmanager
+def profiled(report, python_stats=None):
+    """Profiles the block if a report file is given, and writes the report
+    when the block ends (also on errors and sys.exit)."""
+    if report is None:
+        yield
+        return
+    profile = start(python_stats)
+    try:
+        yield
+    finally:
+        stop()
+        profile.write(report)
@@ -0,0 +1,746 @@
+"""
+Copyright 2023 Budapest University of Technology and Economics
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ctypes
+import itertools
+import os
+import queue
+import selectors
+import signal
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import closing
+from functools import lru_cache, partial
+from math import sqrt
+from statistics import NormalDist
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+from harness_trace import describe, read_summary
+
+MAX_RUNS = 100
+MODES = ("strict", "normal", "permissive")
+ERROR_EXIT_CODE = 74
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MIN_RATE = 0.1
+
+
+def default_jobs():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class RunResult:
+    def __init__(
+        self,
+        returncode,
+        stdout,
+        stderr,
+        duration=0.0,
+        timed_out=False,
+        trace=None,
+        usage=None,
+    ):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.timed_out = timed_out
+        self.trace = trace
+        self.usage = usage
+        self.reached_error = not timed_out and (
+            returncode == ERROR_EXIT_CODE
+            or (trace is not None and trace.reached_error)
+            or (stdout is not None and "Reached error!" in stdout)
+        )
+
+
+class ReachRate:
+    """The rate of the runs reaching the error, with its Wilson score interval
+    at the given confidence."""
+
+    def __init__(self, confidence=DEFAULT_CONFIDENCE):
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.runs = 0
+        self.reached = 0
+
+    def record(self, reached_error):
+        self.runs = self.runs + 1
+        if reached_error:
+            self.reached = self.reached + 1
+
+    def interval(self):
+        if self.runs == 0:
+            return 0.0, 1.0
+        n = self.runs
+        p = self.reached / n
+        z2 = self.z * self.z
+        center = (p + z2 / (2 * n)) / (1 + z2 / n)
+        half = self.z * sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / (1 + z2 / n)
+        return max(center - half, 0.0), min(center + half, 1.0)
+
+    def settled(self, min_rate):
+        """Whether more runs would (almost surely) not change the verdict of
+        the normal mode.
+
+        Once both outcomes were seen, the verdict is SOMETIMES for good.
+        Otherwise it is settled if the rate of the unseen outcome is below
+        min_rate with the given confidence.
+        """
+        if 0 < self.reached < self.runs:
+            return True
+        if min_rate <= 0 or self.runs == 0:
+            return False
+        low, high = self.interval()
+        return high < min_rate or low > 1 - min_rate
+
+    def describe(self):
+        low, high = self.interval()
+        return f"reach rate {low:.2f}-{high:.2f} with {self.confidence:.0%} confidence"
+
+
+def should_stop(mode, reached_error, rate=None, min_rate=0.0):
+    if mode == "strict" and not reached_error:
+        return True
+    if mode == "permissive" and reached_error:
+        return True
+    if mode == "normal" and rate is not None:
+        return rate.settled(min_rate)
+    return False
+
+
+def kill_process_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+# see prctl(2)
+PR_SET_CHILD_SUBREAPER = 36
+# how long the outputs of a run are read after it ended
+DRAIN_TIMEOUT = 1.0
+
+
+@lru_cache(maxsize=None)
+def become_subreaper():
+    """Makes this process adopt the orphaned descendants of the runs (instead
+    of init), so that the processes leaving the process group of a run can
+    still be killed (see kill_orphans). Returns whether it succeeded."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def child_pids():
+    pids = set()
+    try:
+        tasks = os.listdir("/proc/self/task")
+    except OSError:
+        return pids
+    for task in tasks:
+        try:
+            with open(f"/proc/self/task/{task}/children", "r") as f:
+                pids.update(int(pid) for pid in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def run_of(pid):
+    """Returns the C2TT_RUN variable of a process, or None if it is unknown
+    (e.g., for zombies)."""
+    try:
+        with open(f"/proc/{pid}/environ", "rb") as f:
+            variables = f.read().split(b"\0")
+    except OSError:
+        return None
+    for variable in variables:
+        if variable.startswith(b"C2TT_RUN="):
+            return variable[len(b"C2TT_RUN=") :].decode()
+    return None
+
+
+def kill_orphans(known, run=None):
+    """Kills and reaps the children of this process that were not started by
+    it: the orphans adopted from the given run (from any run if None), and
+    those that cannot be attributed to a run, such as zombies."""
+    while True:
+        orphans = [
+            pid
+            for pid in child_pids() - known
+            if run is None or run_of(pid) in (None, run)
+        ]
+        if not orphans:
+            return
+        for pid in orphans:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for pid in orphans:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+
+def harness_env(verbose, **variables):
+    env = dict(os.environ, **variables)
+    if verbose:
+        env["C2TT_VERBOSE"] = "1"
+    return env
+
+
+Usage = namedtuple("Usage", ["user", "system", "peak_rss_kib"])
+
+
+def run_limits(memory=None, cpu=None, processes=None):
+    """Returns the variables telling the harness the resource limits of every
+    run: address space (MiB), CPU time (seconds) and number of processes (of
+    the user), see c2tt_apply_limits in svcomp.c."""
+    limits = {}
+    if memory is not None:
+        limits["C2TT_LIMIT_AS"] = str(memory * 1024 * 1024)
+    if cpu is not None:
+        limits["C2TT_LIMIT_CPU"] = str(cpu)
+    if processes is not None:
+        limits["C2TT_LIMIT_NPROC"] = str(processes)
+    return limits
+
+
+class Run:
+    """The outputs and the end of a single execution of the test binary.
+
+    The outputs are read until the leader of the run exits; then the rest of
+    its process group (e.g., the children it left behind) and its `orphans`
+    are killed, and the outputs are read to their end, for at most
+    DRAIN_TIMEOUT.
+    """
+
+    def watch(self, stdout_fd, stderr_fd, exit_fd):
+        self.outputs = {stdout_fd: [], stderr_fd: []}
+        self.exit_fd = exit_fd
+        self.returncode = None
+        self.usage = None
+        self.orphans = None
+        self.drained_by = None
+        self.selector = selectors.DefaultSelector()
+        for fd in self.outputs:
+            self.selector.register(fd, selectors.EVENT_READ)
+        if exit_fd is not None:
+            self.selector.register(exit_fd, selectors.EVENT_READ)
+
+    def end(self):
+        self.returncode, self.usage = self.reap()
+        kill_process_group(self.pgid)
+        if self.orphans is not None:
+            self.orphans()
+        self.drained_by = time.monotonic() + DRAIN_TIMEOUT
+
+    def abandon(self):
+        """Stops reading the outputs (e.g., a process that could not be killed
+        keeps them open)."""
+        for key in list(self.selector.get_map().values()):
+            self.selector.unregister(key.fd)
+            if key.fd in self.outputs:
+                os.close(key.fd)
+
+    def communicate(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.selector.get_map():
+            now = time.monotonic()
+            if self.drained_by is not None and now >= self.drained_by:
+                self.abandon()
+                break
+            remaining = None if deadline is None else deadline - now
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired("test run", timeout)
+            if self.drained_by is not None:
+                drain = self.drained_by - now
+                remaining = drain if remaining is None else min(remaining, drain)
+            for key, _ in self.selector.select(remaining):
+                if key.fd == self.exit_fd:
+                    self.selector.unregister(key.fd)
+                    self.end()
+                    continue
+                chunk = os.read(key.fd, 65536)
+                if chunk:
+                    self.outputs[key.fd].append(chunk)
+                else:
+                    self.selector.unregister(key.fd)
+                    os.close(key.fd)
+        self.selector.close()
+        if self.returncode is None:
+            self.end()
+        stdout, stderr = (
+            b"".join(chunks).decode(errors="replace")
+            for chunks in self.outputs.values()
+        )
+        return self.returncode, stdout, stderr
+
+
+def output_pipes():
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
+    return (stdout_r, stderr_r), (stdout_w, stderr_w)
+
+
+class ProcessRun(Run):
+    """A single execution of the test binary as a fresh process.
+
+    Its processes inherit C2TT_RUN=`run_id`, which tells the orphans of the
+    concurrent runs apart.
+    """
+
+    def __init__(self, bin_name, run_id, verbose=False, replay=False, limits=None):
+        self.trace = tempfile.TemporaryFile()
+        self.run_id = run_id
+        fd = self.trace.fileno()
+        variables = dict(limits or {}, C2TT_TRACE_FD=str(fd), C2TT_RUN=run_id)
+        if replay:
+            variables["C2TT_REPLAY"] = "1"
+        readers, writers = output_pipes()
+        try:
+            self.process = subprocess.Popen(
+                [bin_name],
+                env=harness_env(verbose, **variables),
+                pass_fds=(fd,),
+                stdout=writers[0],
+                stderr=writers[1],
+                start_new_session=True,
+            )
+        except BaseException:
+            for reader in readers:
+                os.close(reader)
+            raise
+        finally:
+            for writer in writers:
+                os.close(writer)
+        self.pgid = self.process.pid
+        try:
+            exit_fd = os.pidfd_open(self.process.pid)
+        except (AttributeError, OSError):
+            # without pidfds, the end of the run is noticed when its outputs
+            # are closed
+            exit_fd = None
+        self.watch(*readers, exit_fd)
+
+    def reap(self):
+        if self.exit_fd is not None:
+            os.close(self.exit_fd)
+        _, status, usage = os.wait4(self.process.pid, 0)
+        self.process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss would include the memory of this process (Linux carries it
+        # over exec), the peak RSS is recorded by the harness instead
+        return self.process.returncode, Usage(usage.ru_utime, usage.ru_stime, None)
+
+
+class ForkServer:
+    """The test binary waiting before main, forking a child for every run.
+
+    See c2tt_forkserver in svcomp.c for the protocol.
+    """
+
+    # wait status, user and system CPU time (microseconds), peak RSS (KiB)
+    EXIT = struct.Struct("iqqq")
+
+    def __init__(self, bin_name, verbose=False, limits=None):
+        self.socket, server_socket = socket.socketpair()
+        fd = server_socket.fileno()
+        self.process = subprocess.Popen(
+            [bin_name],
+            env=harness_env(verbose, C2TT_FORKSERVER_FD=str(fd), **(limits or {})),
+            pass_fds=(fd,),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        server_socket.close()
+
+    def receive(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise RuntimeError("Fork server terminated unexpectedly")
+            data = data + chunk
+        return data
+
+    def spawn(self, stdout_fd, stderr_fd, trace_fd):
+        socket.send_fds(self.socket, [b"r"], [stdout_fd, stderr_fd, trace_fd])
+        pid = struct.unpack("i", self.receive(4))[0]
+        if pid < 0:
+            raise RuntimeError("Fork server could not fork")
+        return pid
+
+    def wait(self):
+        status, user, system, peak_rss = self.EXIT.unpack(self.receive(self.EXIT.size))
+        usage = Usage(user / 1e6, system / 1e6, peak_rss)
+        return os.waitstatus_to_exitcode(status), usage
+
+    def close(self):
+        self.socket.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            kill_process_group(self.process.pid)
+            self.process.wait()
+
+
+class ForkServerRun(Run):
+    """A single execution of the test binary forked by a ForkServer."""
+
+    def __init__(self, server):
+        self.server = server
+        self.trace = tempfile.TemporaryFile()
+        readers, writers = output_pipes()
+        try:
+            self.pgid = server.spawn(*writers, self.trace.fileno())
+        except BaseException:
+            for reader in readers:
+                os.close(reader)
+            raise
+        finally:
+            for writer in writers:
+                os.close(writer)
+        # the server reports the end of the run on its socket
+        self.watch(*readers, server.socket.fileno())
+
+    def reap(self):
+        return self.server.wait()
+
+
+class RunBudget:
+    """Decides whether another run still fits before the deadline.
+
+    The first `samples` runs are always started; afterwards a run is only
+    started if the mean duration measured so far fits in the remaining time.
+    """
+
+    def __init__(self, deadline=None, run_timeout=None, samples=3):
+        self.deadline = deadline
+        self.run_timeout = run_timeout
+        self.samples = samples
+        self.durations = []
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def record(self, duration):
+        self.durations.append(duration)
+
+    def estimate(self):
+        if len(self.durations) < self.samples:
+            return None
+        return sum(self.durations) / len(self.durations)
+
+    def timeout(self):
+        remaining = self.remaining()
+        if remaining is None:
+            return self.run_timeout
+        if self.run_timeout is None:
+            return max(remaining, 0)
+        return max(min(remaining, self.run_timeout), 0)
+
+    def allows_another(self):
+        remaining = self.remaining()
+        if remaining is None:
+            return True
+        if remaining <= 0:
+            return False
+        estimate = self.estimate()
+        return estimate is None or estimate <= remaining
+
+    def runs_that_fit(self, jobs):
+        remaining = self.remaining()
+        estimate = self.estimate()
+        if remaining is None or estimate is None:
+            return None
+        if estimate == 0:
+            return MAX_RUNS
+        return int(max(remaining, 0) / estimate) * jobs
+
+
+class RunPool:
+    """Runs the test binary concurrently, at most `jobs` processes at a time.
+
+    The pool threads only supervise the child processes (the actual work
+    happens in the children), and results are handed out in submission order
+    so that the stopping rule sees the same sequence as a sequential loop.
+    Every run gets its own process group (and the resource `limits` of
+    run_limits), so a hung run is killed together with everything it spawned,
+    and whatever a run leaves behind is killed once it ends; the processes
+    leaving the process group are adopted (see become_subreaper) and killed
+    as well. With `fork_server`, every pool thread owns a ForkServer instead
+    of executing the binary from scratch for every run.
+    With `replay`, the runs are scheduled deterministically by the harness.
+    """
+
+    def __init__(
+        self,
+        bin_name,
+        jobs,
+        budget=None,
+        fork_server=False,
+        verbose=False,
+        replay=False,
+        limits=None,
+    ):
+        self.bin_name = bin_name
+        self.jobs = max(1, jobs)
+        self.budget = budget if budget is not None else RunBudget()
+        self.fork_server = fork_server
+        self.verbose = verbose
+        self.replay = replay
+        self.limits = limits
+        self.run_ids = itertools.count()
+        # the processes started by the pool (the others are orphans)
+        self.children = set()
+        become_subreaper()
+        self.servers = queue.Queue()
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.runs = set()
+
+    def launch(self):
+        if not self.fork_server:
+            run_id = f"{os.getpid()}-{next(self.run_ids)}"
+            run = ProcessRun(
+                self.bin_name, run_id, self.verbose, self.replay, self.limits
+            )
+            self.children.add(run.process.pid)
+            run.orphans = partial(self.kill_orphans, run)
+            return run, None
+        try:
+            server = self.servers.get_nowait()
+        except queue.Empty:
+            server = ForkServer(self.bin_name, self.verbose, self.limits)
+            self.children.add(server.process.pid)
+        try:
+            return ForkServerRun(server), server
+        except BaseException:
+            server.close()
+            raise
+
+    def execute(self):
+        with self.lock:
+            if self.cancelled.is_set() or not self.budget.allows_another():
+                return None
+            start = time.monotonic()
+            run, server = self.launch()
+            self.runs.add(run)
+        timed_out = False
+        try:
+            try:
+                returncode, stdout, stderr = run.communicate(self.budget.timeout())
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                kill_process_group(run.pgid)
+                try:
+                    returncode, stdout, stderr = run.communicate(DRAIN_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    run.abandon()
+                    returncode, stdout, stderr = run.communicate()
+        except BaseException:
+            kill_process_group(run.pgid)
+            if server is not None:
+                server.close()
+                server = None
+            raise
+        finally:
+            with self.lock:
+                self.runs.discard(run)
+            if server is not None:
+                self.servers.put(server)
+            with run.trace:
+                trace = read_summary(run.trace)
+        duration = time.monotonic() - start
+        if self.cancelled.is_set():
+            return None
+        with self.lock:
+            self.budget.record(duration)
+        # a run exceeding its CPU time limit is killed by SIGXCPU
+        timed_out = timed_out or returncode == -signal.SIGXCPU
+        usage = run.usage
+        if usage is not None and trace.peak_rss_kib is not None:
+            usage = usage._replace(peak_rss_kib=trace.peak_rss_kib)
+        return RunResult(returncode, stdout, stderr, duration, timed_out, trace, usage)
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled.set()
+            for run in self.runs:
+                kill_process_group(run.pgid)
+
+    def kill_orphans(self, run):
+        with self.lock:
+            self.children.discard(run.process.pid)
+            kill_orphans(self.children, run.run_id)
+
+    def close(self):
+        while not self.servers.empty():
+            self.servers.get_nowait().close()
+        with self.lock:
+            kill_orphans(self.children)
+
+    def results(self, runs):
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(self.execute) for _ in range(runs)]
+            try:
+                for future in futures:
+                    result = future.result()
+                    if result is None:
+                        return
+                    yield result
+            finally:
+                self.cancel()
+                executor.shutdown(wait=True, cancel_futures=True)
+                self.close()
+
+
+def print_result(result):
+    print("Execution started")
+    if result.stdout:
+        print(result.stdout)
+    if result.stderr:
+        print(result.stderr)
+    print(describe(result.trace))
+    ended = "timeout" if result.timed_out else f"exit code {result.returncode}"
+    if result.usage is not None:
+        cpu = result.usage.user + result.usage.system
+        ended = ended + f", {cpu:.3f}s CPU"
+        if result.usage.peak_rss_kib is not None:
+            ended = ended + f", {result.usage.peak_rss_kib} KiB peak RSS"
+    print(f"Execution ended ({ended})")
+
+
+def replay_test(bin_name, budget, verbose=False, limits=None):
+    """Runs the test once, scheduled in the order of the witness (see
+    C2TT_REPLAY in svcomp.c), returns whether it reached the error, or None if
+    the run does not decide it.
+
+    Every replay of a fully ordered witness is the same, so one run decides
+    unless it fell back to free scheduling, timed out, or ended with threads
+    still waiting for their steps.
+    """
+    pool = RunPool(bin_name, 1, budget, verbose=verbose, replay=True, limits=limits)
+    with closing(pool.results(1)) as results:
+        result = next(results, None)
+    if result is None:
+        return None
+    profiling.record_run(result)
+    print_result(result)
+    if result.timed_out or result.trace.fell_back:
+        return None
+    if not result.reached_error and result.trace.waiting:
+        return None
+    return result.reached_error
+
+
+def run_tests(
+    bin_name,
+    modes,
+    jobs=1,
+    runs=MAX_RUNS,
+    deadline=None,
+    run_timeout=None,
+    fork_server=False,
+    verbose=False,
+    confidence=DEFAULT_CONFIDENCE,
+    min_rate=DEFAULT_MIN_RATE,
+    replay=False,
+    limits=None,
+):
+    """Executes the test until the verdict of every mode is decided, returns
+    the histogram of the outcomes and the observed reach rate of each mode.
+
+    With `replay`, the test is first replayed once (see replay_test), and the
+    runs are only repeated if the replay does not decide the verdict.
+
+    The modes share one sequence of runs: every mode sees its outcomes up to
+    the run its own loop would have stopped after, so its verdict is the same
+    as if it was run alone. In normal mode, the runs stop early once the reach
+    rate settles the verdict (see ReachRate.settled); min_rate=0 disables the
+    statistical stopping rule.
+    """
+    codes = {mode: {} for mode in modes}
+    rates = {mode: ReachRate(confidence) for mode in modes}
+    executions = {}
+    outcomes = []
+    budget = RunBudget(deadline, run_timeout)
+    if replay:
+        reached_error = replay_test(bin_name, budget, verbose, limits)
+        if reached_error is not None:
+            print("Verdict decided by a deterministic replay")
+            code = -1 if reached_error else 0
+            for mode in modes:
+                codes[mode][code] = 1
+                rates[mode].record(reached_error)
+            return {mode: (codes[mode], rates[mode]) for mode in modes}
+        print("The replay did not decide the verdict, repeating the executions")
+        budget.durations.clear()
+    executed = 0
+    pool = RunPool(bin_name, jobs, budget, fork_server, verbose, limits=limits)
+    with closing(pool.results(runs)) as results:
+        for result in results:
+            executed = executed + 1
+            profiling.record_run(result)
+            print_result(result)
+            if result.timed_out:
+                outcomes.append("T")
+                continue
+            if executed == budget.samples and budget.deadline is not None:
+                fit = budget.runs_that_fit(jobs)
+                if fit is not None:
+                    fit = min(fit, runs - executed)
+                print(f"Estimated {fit} more executions fit in the remaining time")
+            outcomes.append("E" if result.reached_error else ".")
+            code = -1 if result.reached_error else 0
+            for mode in modes:
+                if mode in executions:
+                    continue
+                codes[mode][code] = codes[mode].get(code, 0) + 1
+                rates[mode].record(result.reached_error)
+                if should_stop(mode, result.reached_error, rates[mode], min_rate):
+                    executions[mode] = executed
+            if len(executions) == len(modes):
+                break
+    if len(modes) > 1:
+        print(f"Outcomes: {''.join(outcomes)}")
+    for mode in modes:
+        stopped = executions.get(mode)
+        prefix = f"{mode}: " if len(modes) > 1 else ""
+        if stopped is None and executed < runs:
+            print(
+                f"{prefix}Time budget exhausted after {executed} of {runs} executions"
+            )
+        elif stopped is not None and mode == "normal" and stopped < runs:
+            print(f"{prefix}Verdict settled after {stopped} of {runs} executions")
+    return {mode: (codes[mode], rates[mode]) for mode in modes}
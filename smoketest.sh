@@ -1,2 +1,12 @@
 #!/bin/bash
+# the normalizer must keep producing the reference output (same length and offsets)
+venv/bin/python3 -c 'import sys, normalizer; sys.stdout.write(normalizer.normalize(open(sys.argv[1]).read()))' example/normalize.c | cmp - example/normalize.c.expected || exit 1
+# instrumenting must keep producing the reference output (replacement by later siblings of enclosing compounds, several yields/releases at one statement, wrapped loop and branch bodies, nondet assumptions)
+venv/bin/python3 -c 'import sys, main; from pycparser.c_generator import CGenerator; content = open(sys.argv[1]).read(); ast = main.parse(content, sys.argv[1]); main.instrument(ast, content, sys.argv[2]); sys.stdout.write(CGenerator().visit(ast))' example/instrument.c example/instrument.c.graphml | cmp - example/instrument.c.expected || exit 1
 ./start.sh example/mix000.opt.i --witness example/mix000.opt.i.graphml --mode permissive
+# every execution backend must keep working (the harness code they use only breaks at run time)
+./start.sh example/mix000.opt.i --witness example/mix000.opt.i.graphml --mode permissive --fork-server | grep -qx "Verdict: NEVER" || exit 1
+./start.sh example/mix000.opt.i --witness example/mix000.opt.i.graphml --mode permissive --sync mutex | grep -qx "Verdict: NEVER" || exit 1
+./start.sh example/mix000.opt.i --witness example/mix000.opt.i.graphml --mode all | grep -qx 'Verdicts: {"strict": "NEVER", "normal": "NEVER", "permissive": "NEVER"}' || exit 1
+# a fully ordered witness is replayed deterministically, reaching the error in its single execution
+./start.sh example/ordered.c --witness example/ordered.c.graphml --replay | grep -qx "Verdict: ALWAYS" || exit 1
@@ -2,5 +2,11 @@
 scriptdir=$(dirname $0)
 
 #echo $scriptdir/venv/bin/python3 $scriptdir/main.py $@ >&2
-# shellcheck disable=SC2068
-"$scriptdir"/venv/bin/python3 "$scriptdir"/main.py $@
+if [ -n "$C2TT_DAEMON" ]; then
+  # validate in the daemon listening on $C2TT_DAEMON (see daemon.py), if any
+  # shellcheck disable=SC2068
+  "$scriptdir"/venv/bin/python3 "$scriptdir"/client.py $@
+else
+  # shellcheck disable=SC2068
+  "$scriptdir"/venv/bin/python3 "$scriptdir"/main.py $@
+fi
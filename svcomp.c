@@ -21,6 +21,83 @@
 #include <stdatomic.h>
 #include <threads.h>
 #include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/socket.h>
+#include <sys/wait.h>
+#include <sys/mman.h>
+#include <sys/prctl.h>
+#include <sys/resource.h>
+#include <signal.h>
+#include <time.h>
+
+/*
+ * Trace: when C2TT_TRACE_FD names a file (or the fork server passed one), the
+ * synchronization events are recorded in a ring buffer mapped from that file,
+ * so they survive even if the run crashes or is killed. See harness_trace.py
+ * for the layout. The printf tracing of the events is only enabled by
+ * C2TT_VERBOSE. The header also records the peak RSS of the run (see
+ * c2tt_record_peak).
+ */
+#define C2TT_TRACE_CAPACITY 4096
+
+enum { C2TT_PAUSED = 1, C2TT_RESUMED, C2TT_RELEASED, C2TT_REACHED_ERROR, C2TT_FELL_BACK };
+
+struct c2tt_event {
+    uint64_t time;
+    int32_t step;
+    int16_t thread;
+    _Atomic uint16_t kind; // written last, 0 while the event is incomplete
+};
+
+struct c2tt_trace {
+    char magic[4];
+    uint32_t capacity;
+    atomic_uint count;
+    uint32_t peak_rss_kib;
+    struct c2tt_event events[];
+};
+
+static int c2tt_trace_fd = -1;
+static struct c2tt_trace *c2tt_trace;
+static int c2tt_verbose;
+static once_flag c2tt_trace_once = ONCE_FLAG_INIT;
+
+static void c2tt_trace_init(void) {
+    const char *verbose = getenv("C2TT_VERBOSE");
+    c2tt_verbose = verbose && *verbose && strcmp(verbose, "0") != 0;
+    const char *fd_env = getenv("C2TT_TRACE_FD");
+    if (c2tt_trace_fd < 0 && fd_env) c2tt_trace_fd = atoi(fd_env);
+    if (c2tt_trace_fd < 0) return;
+    size_t size = sizeof(struct c2tt_trace) + C2TT_TRACE_CAPACITY * sizeof(struct c2tt_event);
+    if (ftruncate(c2tt_trace_fd, size) != 0) return;
+    void *trace = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, c2tt_trace_fd, 0);
+    if (trace == MAP_FAILED) return;
+    c2tt_trace = trace;
+    c2tt_trace->capacity = C2TT_TRACE_CAPACITY;
+    memcpy(c2tt_trace->magic, "C2TT", 4);
+}
+
+static void c2tt_event(int kind, int step, int thread) {
+    call_once(&c2tt_trace_once, c2tt_trace_init);
+    if (!c2tt_trace) return;
+    unsigned n = atomic_fetch_add(&c2tt_trace->count, 1);
+    struct c2tt_event *event = &c2tt_trace->events[n % C2TT_TRACE_CAPACITY];
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    atomic_store_explicit(&event->kind, 0, memory_order_relaxed);
+    event->time = (uint64_t) now.tv_sec * 1000000000u + now.tv_nsec;
+    event->step = step;
+    event->thread = thread;
+    atomic_store_explicit(&event->kind, kind, memory_order_release);
+}
+
+#define C2TT_LOG(...) do { \
+    call_once(&c2tt_trace_once, c2tt_trace_init); \
+    if (c2tt_verbose) printf(__VA_ARGS__); \
+} while (0)
 
 void __VERIFIER_atomic_begin() {
 
@@ -29,30 +106,514 @@ void __VERIFIER_atomic_end(void) {
 
 }
 void reach_error() {
+    c2tt_event(C2TT_REACHED_ERROR, -1, -1);
     printf("Reached error!\n");
     fflush( stdout );
     exit(74);
 }
 
+/*
+ * Resource limits of a run: C2TT_LIMIT_AS (bytes of address space),
+ * C2TT_LIMIT_CPU (seconds of CPU time) and C2TT_LIMIT_NPROC (processes of the
+ * user), applied before main (in the fork server, to every forked child).
+ */
+static void c2tt_limit(int resource, const char *name) {
+    const char *value = getenv(name);
+    if (!value || !*value) return;
+    rlim_t limit = strtoull(value, NULL, 10);
+    struct rlimit rlimit = { limit, limit };
+    if (resource == RLIMIT_CPU) rlimit.rlim_max = limit + 1; // SIGXCPU first, then SIGKILL
+    setrlimit(resource, &rlimit);
+}
+
+static void c2tt_apply_limits(void) {
+    c2tt_limit(RLIMIT_AS, "C2TT_LIMIT_AS");
+    c2tt_limit(RLIMIT_CPU, "C2TT_LIMIT_CPU");
+    c2tt_limit(RLIMIT_NPROC, "C2TT_LIMIT_NPROC");
+}
+
+/*
+ * Peak RSS: the high-water mark of the resident set of the run (VmHWM),
+ * recorded in the trace when it exits or dies of a fatal signal. Unlike the
+ * ru_maxrss of wait4, it does not include the memory of the process that
+ * executed the test, which Linux carries over exec. Only uses async-signal-safe
+ * calls, as it also runs in signal handlers.
+ */
+static void c2tt_record_peak(void) {
+    if (!c2tt_trace) return;
+    char status[4096];
+    int fd = open("/proc/self/status", O_RDONLY);
+    if (fd < 0) return;
+    ssize_t size = read(fd, status, sizeof(status) - 1);
+    close(fd);
+    if (size <= 0) return;
+    status[size] = '\0';
+    const char *line = strstr(status, "VmHWM:");
+    if (!line) return;
+    uint32_t peak = 0;
+    for (line += 6; *line == ' ' || *line == '\t'; line++) {}
+    for (; *line >= '0' && *line <= '9'; line++) peak = peak * 10 + (*line - '0');
+    c2tt_trace->peak_rss_kib = peak;
+}
+
+static void c2tt_fatal_signal(int sig) {
+    c2tt_record_peak();
+    raise(sig); // the handler was reset, so this terminates the run
+}
+
+// prepares a run just before main: its limits, trace and peak RSS recording
+static void c2tt_start(void) {
+    c2tt_apply_limits();
+    call_once(&c2tt_trace_once, c2tt_trace_init);
+    atexit(c2tt_record_peak);
+    static const int fatal[] = { SIGABRT, SIGSEGV, SIGBUS, SIGFPE, SIGILL, SIGXCPU };
+    struct sigaction action = { 0 };
+    action.sa_handler = c2tt_fatal_signal;
+    action.sa_flags = SA_RESETHAND;
+    sigemptyset(&action.sa_mask);
+    for (size_t i = 0; i < sizeof(fatal) / sizeof(fatal[0]); i++) sigaction(fatal[i], &action, NULL);
+}
+
+/*
+ * Fork server: when C2TT_FORKSERVER_FD names a unix socket, the test stops
+ * before main and forks a fresh child for every request. A request carries
+ * the stdout, stderr and trace file of the run as file descriptors; the server answers
+ * with the pid of the child (which leads its own process group) and, once the
+ * child has terminated, with a struct c2tt_exit. The server is a subreaper:
+ * once the child terminated, whatever it left behind (in its process group or
+ * not) is killed and reaped before the next request.
+ */
+struct c2tt_exit {
+    int status;
+    int64_t user_us;
+    int64_t system_us;
+    int64_t peak_rss_kib;
+};
+static int c2tt_recv_fds(int sock, int *fds) {
+    char byte;
+    struct iovec iov = { .iov_base = &byte, .iov_len = 1 };
+    char control[CMSG_SPACE(3 * sizeof(int))];
+    struct msghdr msg = { 0 };
+    msg.msg_iov = &iov;
+    msg.msg_iovlen = 1;
+    msg.msg_control = control;
+    msg.msg_controllen = sizeof(control);
+    if (recvmsg(sock, &msg, 0) <= 0) return 0;
+    struct cmsghdr *cmsg = CMSG_FIRSTHDR(&msg);
+    if (!cmsg || cmsg->cmsg_type != SCM_RIGHTS || cmsg->cmsg_len != CMSG_LEN(3 * sizeof(int))) return 0;
+    memcpy(fds, CMSG_DATA(cmsg), 3 * sizeof(int));
+    return 1;
+}
+
+static void c2tt_send_int(int sock, int value) {
+    if (send(sock, &value, sizeof(value), 0) != sizeof(value)) _exit(1);
+}
+
+// kills and reaps the remaining children (adopted from the run) of the server
+static void c2tt_reap_orphans(void) {
+    char path[64];
+    snprintf(path, sizeof(path), "/proc/self/task/%d/children", (int) getpid());
+    for (;;) {
+        FILE *children = fopen(path, "r");
+        if (!children) break;
+        int pid, found = 0;
+        while (fscanf(children, "%d", &pid) == 1) {
+            kill(pid, SIGKILL);
+            found = 1;
+        }
+        fclose(children);
+        if (!found) break;
+        while (waitpid(-1, NULL, 0) < 0 && errno == EINTR) {}
+    }
+    while (waitpid(-1, NULL, WNOHANG) > 0) {}
+}
+
+__attribute__((constructor)) static void c2tt_forkserver(void) {
+    const char *sock_env = getenv("C2TT_FORKSERVER_FD");
+    if (!sock_env) {
+        c2tt_start();
+        return;
+    }
+    int sock = atoi(sock_env);
+    unsetenv("C2TT_FORKSERVER_FD");
+    prctl(PR_SET_CHILD_SUBREAPER, 1);
+    int fds[3];
+    while (c2tt_recv_fds(sock, fds)) {
+        pid_t pid = fork();
+        if (pid == 0) {
+            close(sock);
+            setpgid(0, 0);
+            dup2(fds[0], STDOUT_FILENO);
+            dup2(fds[1], STDERR_FILENO);
+            close(fds[0]);
+            close(fds[1]);
+            c2tt_trace_fd = fds[2];
+            c2tt_start();
+            return;
+        }
+        close(fds[0]);
+        close(fds[1]);
+        close(fds[2]);
+        if (pid < 0) {
+            c2tt_send_int(sock, -1);
+            continue;
+        }
+        setpgid(pid, pid);
+        c2tt_send_int(sock, pid);
+        struct c2tt_exit ended = { 0 };
+        struct rusage usage = { 0 };
+        while (wait4(pid, &ended.status, 0, &usage) < 0 && errno == EINTR) {}
+        kill(-pid, SIGKILL);
+        c2tt_reap_orphans();
+        ended.user_us = usage.ru_utime.tv_sec * 1000000LL + usage.ru_utime.tv_usec;
+        ended.system_us = usage.ru_stime.tv_sec * 1000000LL + usage.ru_stime.tv_usec;
+        ended.peak_rss_kib = usage.ru_maxrss;
+        if (send(sock, &ended, sizeof(ended), 0) != sizeof(ended)) _exit(1);
+    }
+    _exit(0);
+}
+
 atomic_int c2tt_global_counter = 0;
+
+#ifdef C2TT_REPLAY
+/*
+ * Replay (-DC2TT_REPLAY, enabled by C2TT_REPLAY=1 at run time): only the
+ * thread holding the scheduler token runs. The token is passed on only when
+ * its holder waits for a later step, joins a running thread, finds a mutex
+ * locked or terminates: to the thread waiting for the step reached, if any,
+ * otherwise to the next runnable thread in the order of creation. Thread
+ * creation, atomic regions and the steps thus happen in the order of the
+ * witness, and every run is scheduled the same way.
+ *
+ * If no thread can take the token (a deadlock), or the token makes no progress
+ * for C2TT_PATIENCE_MS (e.g., its holder busy-waits for another thread), the
+ * run falls back to the free scheduling of the backends below, and records a
+ * C2TT_FELL_BACK event. The test must be linked with --wrap for the pthread
+ * functions below (see REPLAY_FLAGS in compiler.py).
+ */
+#include <pthread.h>
+
+#define C2TT_MAX_THREADS 256
+#define C2TT_PATIENCE_MS 1000
+
+enum { C2TT_RUNNABLE, C2TT_WAITING, C2TT_JOINING, C2TT_DONE };
+
+struct c2tt_thread {
+    pthread_t id;
+    int state;
+    int step;   // the step a C2TT_WAITING thread waits for
+    int joined; // the thread a C2TT_JOINING thread joins
+};
+
+struct c2tt_start {
+    void *(*routine)(void *);
+    void *arg;
+    int self;
+};
+
+static struct c2tt_thread c2tt_threads[C2TT_MAX_THREADS];
+static int c2tt_thread_count = 1;
+static int c2tt_owner;
+static atomic_int c2tt_replay;
+static atomic_uint c2tt_progress;
+static mtx_t c2tt_sched_mtx;
+static cnd_t c2tt_sched_cv;
+static once_flag c2tt_replay_once = ONCE_FLAG_INIT;
+static _Thread_local int c2tt_self;
+
+int __real_pthread_create(pthread_t *, const pthread_attr_t *, void *(*)(void *), void *);
+int __real_pthread_join(pthread_t, void **);
+void __real_pthread_exit(void *) __attribute__((noreturn));
+int __real_pthread_mutex_lock(pthread_mutex_t *);
+
+// the functions below expect c2tt_sched_mtx to be locked
+
+static void c2tt_fall_back(void) {
+    if (!atomic_load(&c2tt_replay)) return;
+    atomic_store(&c2tt_replay, 0);
+    c2tt_event(C2TT_FELL_BACK, atomic_load(&c2tt_global_counter), -1);
+    C2TT_LOG("Replay fell back to free scheduling\n");
+    cnd_broadcast(&c2tt_sched_cv);
+}
+
+static int c2tt_next(int from) {
+    int counter = atomic_load(&c2tt_global_counter);
+    int next = -1;
+    for (int i = 0; i < c2tt_thread_count; i++) {
+        struct c2tt_thread *thread = &c2tt_threads[i];
+        if (thread->state == C2TT_WAITING && thread->step <= counter
+                && (next < 0 || thread->step < c2tt_threads[next].step)) {
+            next = i;
+        }
+    }
+    if (next >= 0) return next;
+    for (int n = 1; n <= c2tt_thread_count; n++) {
+        int i = (from + n) % c2tt_thread_count;
+        struct c2tt_thread *thread = &c2tt_threads[i];
+        if (thread->state == C2TT_RUNNABLE) return i;
+        if (thread->state == C2TT_JOINING && c2tt_threads[thread->joined].state == C2TT_DONE) return i;
+    }
+    return -1;
+}
+
+static void c2tt_pass(void) {
+    int next = c2tt_next(c2tt_self);
+    if (next < 0) {
+        c2tt_fall_back(); // deadlock
+        return;
+    }
+    c2tt_owner = next;
+    cnd_broadcast(&c2tt_sched_cv);
+}
+
+static void c2tt_wait_token(void) {
+    while (atomic_load(&c2tt_replay) && c2tt_owner != c2tt_self) {
+        cnd_wait(&c2tt_sched_cv, &c2tt_sched_mtx);
+    }
+}
+
+static void c2tt_finish(void) {
+    mtx_lock(&c2tt_sched_mtx);
+    c2tt_threads[c2tt_self].state = C2TT_DONE;
+    atomic_fetch_add(&c2tt_progress, 1);
+    if (atomic_load(&c2tt_replay) && c2tt_owner == c2tt_self) c2tt_pass();
+    mtx_unlock(&c2tt_sched_mtx);
+}
+
+static int c2tt_watchdog(void *arg) {
+    unsigned last = atomic_load(&c2tt_progress);
+    int last_step = atomic_load(&c2tt_global_counter);
+    struct timespec patience = { C2TT_PATIENCE_MS / 1000, C2TT_PATIENCE_MS % 1000 * 1000000L };
+    while (atomic_load(&c2tt_replay)) {
+        thrd_sleep(&patience, NULL);
+        unsigned progress = atomic_load(&c2tt_progress);
+        int step = atomic_load(&c2tt_global_counter);
+        if (progress == last && step == last_step) {
+            mtx_lock(&c2tt_sched_mtx);
+            c2tt_fall_back();
+            mtx_unlock(&c2tt_sched_mtx);
+        }
+        last = progress;
+        last_step = step;
+    }
+    return 0;
+}
+
+static void c2tt_replay_init(void) {
+    const char *replay = getenv("C2TT_REPLAY");
+    if (!replay || !*replay || strcmp(replay, "0") == 0) return;
+    mtx_init(&c2tt_sched_mtx, mtx_plain);
+    cnd_init(&c2tt_sched_cv);
+    c2tt_threads[0].id = pthread_self();
+    atomic_store(&c2tt_replay, 1);
+    thrd_t watchdog;
+    if (thrd_create(&watchdog, c2tt_watchdog, NULL) == thrd_success) thrd_detach(watchdog);
+    C2TT_LOG("Replaying the witness\n");
+}
+
+static int c2tt_replaying(void) {
+    call_once(&c2tt_replay_once, c2tt_replay_init);
+    return atomic_load(&c2tt_replay);
+}
+
+// returns 0 if the caller has to wait in the free backend
+static int c2tt_replay_yield(int target_value, int threadid) {
+    if (!c2tt_replaying()) return 0;
+    mtx_lock(&c2tt_sched_mtx);
+    if (atomic_load(&c2tt_global_counter) >= target_value) {
+        mtx_unlock(&c2tt_sched_mtx);
+        return 1;
+    }
+    c2tt_event(C2TT_PAUSED, target_value, threadid);
+    C2TT_LOG("Paused thread %d at %d until %d\n", threadid, atomic_load(&c2tt_global_counter), target_value);
+    struct c2tt_thread *self = &c2tt_threads[c2tt_self];
+    self->state = C2TT_WAITING;
+    self->step = target_value;
+    atomic_fetch_add(&c2tt_progress, 1);
+    c2tt_pass();
+    c2tt_wait_token();
+    self->state = C2TT_RUNNABLE;
+    int replaying = atomic_load(&c2tt_replay);
+    mtx_unlock(&c2tt_sched_mtx);
+    if (!replaying) return 0;
+    c2tt_event(C2TT_RESUMED, target_value, threadid);
+    C2TT_LOG("Resumed thread %d at %d\n", threadid, target_value);
+    return 1;
+}
+
+static void *c2tt_start_routine(void *arg) {
+    struct c2tt_start start = *(struct c2tt_start *) arg;
+    free(arg);
+    c2tt_self = start.self;
+    mtx_lock(&c2tt_sched_mtx);
+    c2tt_wait_token();
+    mtx_unlock(&c2tt_sched_mtx);
+    void *result = start.routine(start.arg);
+    c2tt_finish();
+    return result;
+}
+
+int __wrap_pthread_create(pthread_t *thread, const pthread_attr_t *attr, void *(*routine)(void *), void *arg) {
+    if (!c2tt_replaying()) return __real_pthread_create(thread, attr, routine, arg);
+    struct c2tt_start *start = malloc(sizeof(*start));
+    mtx_lock(&c2tt_sched_mtx);
+    int self = c2tt_thread_count;
+    if (!start || self == C2TT_MAX_THREADS) {
+        c2tt_fall_back();
+        mtx_unlock(&c2tt_sched_mtx);
+        free(start);
+        return __real_pthread_create(thread, attr, routine, arg);
+    }
+    start->routine = routine;
+    start->arg = arg;
+    start->self = self;
+    int result = __real_pthread_create(thread, attr, c2tt_start_routine, start);
+    if (result == 0) {
+        c2tt_threads[self] = (struct c2tt_thread) { .id = *thread, .state = C2TT_RUNNABLE };
+        c2tt_thread_count++;
+        atomic_fetch_add(&c2tt_progress, 1);
+    } else {
+        free(start);
+    }
+    mtx_unlock(&c2tt_sched_mtx);
+    return result;
+}
+
+int __wrap_pthread_join(pthread_t thread, void **result) {
+    if (c2tt_replaying()) {
+        mtx_lock(&c2tt_sched_mtx);
+        int joined = -1;
+        for (int i = 1; i < c2tt_thread_count; i++) {
+            if (pthread_equal(c2tt_threads[i].id, thread)) joined = i; // the last one, ids are reused
+        }
+        struct c2tt_thread *self = &c2tt_threads[c2tt_self];
+        while (joined > 0 && atomic_load(&c2tt_replay) && c2tt_threads[joined].state != C2TT_DONE) {
+            self->state = C2TT_JOINING;
+            self->joined = joined;
+            atomic_fetch_add(&c2tt_progress, 1);
+            c2tt_pass();
+            c2tt_wait_token();
+            self->state = C2TT_RUNNABLE;
+        }
+        mtx_unlock(&c2tt_sched_mtx);
+    }
+    return __real_pthread_join(thread, result);
+}
+
+void __wrap_pthread_exit(void *result) {
+    if (c2tt_replaying()) c2tt_finish();
+    __real_pthread_exit(result);
+}
+
+int __wrap_pthread_mutex_lock(pthread_mutex_t *mutex) {
+    while (c2tt_replaying()) {
+        int result = pthread_mutex_trylock(mutex);
+        if (result != EBUSY) return result;
+        // let the others run until the holder unlocks it (not a progress)
+        mtx_lock(&c2tt_sched_mtx);
+        if (c2tt_next(c2tt_self) == c2tt_self) {
+            c2tt_fall_back(); // the holder cannot run
+        } else {
+            c2tt_pass();
+            c2tt_wait_token();
+        }
+        mtx_unlock(&c2tt_sched_mtx);
+    }
+    return __real_pthread_mutex_lock(mutex);
+}
+#else
+#define c2tt_replay_yield(target_value, threadid) 0
+#endif
+
+#if defined(__linux__) && !defined(C2TT_SYNC_MUTEX)
+/*
+ * Futex backend (default): a thread waiting for step N sleeps on the wait slot
+ * of N, so a release only wakes the threads waiting for the steps it reaches
+ * (and the few sharing their slots), instead of every waiting thread.
+ */
+#include <limits.h>
+#include <linux/futex.h>
+#include <sys/syscall.h>
+
+#define C2TT_SLOTS 64
+
+struct c2tt_slot {
+    _Alignas(64) atomic_uint seq;
+    atomic_int waiters;
+};
+static struct c2tt_slot c2tt_slots[C2TT_SLOTS];
+
+static struct c2tt_slot *c2tt_slot_of(int step) {
+    return &c2tt_slots[(unsigned) step % C2TT_SLOTS];
+}
+
+void yield(int target_value, int threadid) {
+    if (c2tt_replay_yield(target_value, threadid)) return;
+    if (atomic_load(&c2tt_global_counter) >= target_value) {
+        return; // Return immediately if the global counter is greater or equal to the target value.
+    }
+    c2tt_event(C2TT_PAUSED, target_value, threadid);
+    C2TT_LOG("Paused thread %d at %d until %d\n", threadid, atomic_load(&c2tt_global_counter), target_value);
+
+    struct c2tt_slot *slot = c2tt_slot_of(target_value);
+    atomic_fetch_add(&slot->waiters, 1);
+    for (;;) {
+        unsigned seq = atomic_load(&slot->seq);
+        if (atomic_load(&c2tt_global_counter) >= target_value) break;
+        syscall(SYS_futex, &slot->seq, FUTEX_WAIT_PRIVATE, seq, NULL, NULL, 0);
+    }
+    atomic_fetch_sub(&slot->waiters, 1);
+    c2tt_event(C2TT_RESUMED, target_value, threadid);
+    C2TT_LOG("Resumed thread %d at %d\n", threadid, target_value);
+}
+
+void release(int target_value, int threadid) {
+    int current = atomic_load(&c2tt_global_counter);
+    do {
+        if (current > target_value) {
+            return; // Return immediately if the global counter is greater than the target value.
+        }
+    } while (!atomic_compare_exchange_weak(&c2tt_global_counter, &current, target_value + 1));
+
+    // wake the waiters of the steps current + 1 .. target_value + 1
+    int steps = target_value + 1 - current;
+    for (int i = 0; i < steps && i < C2TT_SLOTS; i++) {
+        struct c2tt_slot *slot = c2tt_slot_of(target_value + 1 - i);
+        atomic_fetch_add(&slot->seq, 1);
+        if (atomic_load(&slot->waiters)) {
+            syscall(SYS_futex, &slot->seq, FUTEX_WAKE_PRIVATE, INT_MAX, NULL, NULL, 0);
+        }
+    }
+    c2tt_event(C2TT_RELEASED, target_value + 1, threadid);
+    C2TT_LOG("Released %d\n", target_value + 1);
+}
+
+#else
+/*
+ * Mutex backend (-DC2TT_SYNC_MUTEX): every waiting thread is woken on every
+ * step, and checks the counter itself.
+ */
 mtx_t c2tt_mtx;
 cnd_t c2tt_cv;
-_Bool c2tt_init;
+once_flag c2tt_init = ONCE_FLAG_INIT;
+
+static void c2tt_init_sync(void) {
+    mtx_init(&c2tt_mtx, mtx_plain);
+    cnd_init(&c2tt_cv);
+    C2TT_LOG("Initialized variables\n");
+}
 
 void yield(int target_value, int threadid) {
-    if(!c2tt_init) {
-        c2tt_init = 1;
-        mtx_init(&c2tt_mtx, mtx_plain);
-        cnd_init(&c2tt_cv);
-        printf("Initialized variables\n");
-    }
+    if (c2tt_replay_yield(target_value, threadid)) return;
+    call_once(&c2tt_init, c2tt_init_sync);
     mtx_lock(&c2tt_mtx);
 
     if (atomic_load(&c2tt_global_counter) >= target_value) {
         mtx_unlock(&c2tt_mtx);
         return; // Return immediately if the global counter is greater or equal to the target value.
     }
-    printf("Paused thread %d at %d until %d\n", threadid, atomic_load(&c2tt_global_counter), target_value);
+    c2tt_event(C2TT_PAUSED, target_value, threadid);
+    C2TT_LOG("Paused thread %d at %d until %d\n", threadid, atomic_load(&c2tt_global_counter), target_value);
     cnd_broadcast(&c2tt_cv);
 
     while (atomic_load(&c2tt_global_counter) < target_value) {
@@ -60,10 +621,12 @@ void yield(int target_value, int threadid) {
     }
 
     mtx_unlock(&c2tt_mtx);
-    printf("Resumed thread %d at %d\n", threadid, target_value);
+    c2tt_event(C2TT_RESUMED, target_value, threadid);
+    C2TT_LOG("Resumed thread %d at %d\n", threadid, target_value);
 }
 
 void release(int target_value, int threadid) {
+    call_once(&c2tt_init, c2tt_init_sync);
     mtx_lock(&c2tt_mtx);
     if (atomic_load(&c2tt_global_counter) > target_value) {
         mtx_unlock(&c2tt_mtx);
@@ -72,9 +635,11 @@ void release(int target_value, int threadid) {
 
     atomic_store(&c2tt_global_counter, target_value + 1);
     cnd_broadcast(&c2tt_cv);
-    printf("Released %d\n", target_value + 1);
+    c2tt_event(C2TT_RELEASED, target_value + 1, threadid);
+    C2TT_LOG("Released %d\n", target_value + 1);
     mtx_unlock(&c2tt_mtx);
 }
+#endif
 
 
 _Bool __VERIFIER_nondet_bool(void) { return 0; }
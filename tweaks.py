@@ -14,7 +14,23 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from pycparser.c_ast import FuncDef, Decl, Struct, TypeDecl
+import bisect
+
+from pycparser.c_ast import (
+    FuncDef,
+    Decl,
+    Struct,
+    Union,
+    Enum,
+    Enumerator,
+    TypeDecl,
+    Typedef,
+    ID,
+    IdentifierType,
+    FuncCall,
+)
+
+ROOTS = ["main", "reach_error"]
 
 
 def reach_error(ast):
@@ -34,6 +50,10 @@ def reach_error(ast):
             ast.ext.insert(0, extern_decl)
 
 
+# fix_inline and fix_struct_def return the top-level nodes they modify, which
+# are then generated instead of copied from the source (see emitter.py)
+
+
 # This is a problem with some SV-COMP benchmarks
 def fix_inline(ast):
     inline_defs = [
@@ -45,11 +65,13 @@ def fix_inline(ast):
     ]
     for inline_def in inline_defs:
         inline_def.decl.funcspec = ["extern", "inline"]
+    return inline_defs
 
 
 # This is a problem with pycparser
 def fix_struct_def(ast):
     struct_decls = set()
+    modified = []
     for node in ast.ext:
         if (
             isinstance(node, Decl)
@@ -58,8 +80,104 @@ def fix_struct_def(ast):
         ):
             if node.type.type.name in struct_decls:
                 node.type.type = Struct(node.type.type.name, decls=None)
+                modified.append(node)
             else:
                 struct_decls.add(node.type.type.name)
+    return modified
+
+
+def descendants(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(child for _, child in node.children())
+
+
+def is_thread_creation(node):
+    return (
+        isinstance(node, FuncCall)
+        and isinstance(node.name, ID)
+        and node.name.name == "pthread_create"
+        and node.args is not None
+        and len(node.args.exprs) > 2
+    )
+
+
+def symbols(node):
+    """Returns the names a top-level node defines and uses, and the thread
+    functions it passes to pthread_create. Tags are ("tag", name) tuples."""
+    defined = set()
+    used = set()
+    threads = set()
+    if isinstance(node, FuncDef):
+        defined.add(node.decl.name)
+    elif isinstance(node, (Decl, Typedef)) and node.name:
+        defined.add(node.name)
+    for n in descendants(node):
+        if isinstance(n, ID):
+            used.add(n.name)
+        elif isinstance(n, IdentifierType):
+            used.update(n.names)
+        elif isinstance(n, Enumerator):
+            defined.add(n.name)
+        elif isinstance(n, (Struct, Union, Enum)) and n.name:
+            body = n.values if isinstance(n, Enum) else n.decls
+            (used if body is None else defined).add(("tag", n.name))
+        elif is_thread_creation(n):
+            threads.update(
+                m.name for m in descendants(n.args.exprs[2]) if isinstance(m, ID)
+            )
+    # forward declarations (e.g., struct s;) belong to their tag
+    if not defined and isinstance(node, Decl):
+        defined = {name for name in used if isinstance(name, tuple)}
+    return defined, used, threads
+
+
+def remove_unused(ast, keep_lines=()):
+    """Removes the top-level functions and declarations that are not reachable
+    from main, the thread functions and reach_error.
+
+    A top-level node spans the lines up to the next one; the nodes spanning
+    one of keep_lines (e.g., the lines of the witness) are kept with
+    everything they use. Nodes that define nothing are always kept.
+    """
+    nodes = [symbols(node) for node in ast.ext]
+    definers = {}
+    for i, (defined, _, _) in enumerate(nodes):
+        for name in defined:
+            definers.setdefault(name, []).append(i)
+    if "main" not in definers:
+        return
+
+    keep = set(i for i, (defined, _, _) in enumerate(nodes) if not defined)
+    starts = sorted(
+        (node.coord.line, i) for i, node in enumerate(ast.ext) if node.coord
+    )
+    lines = [line for line, _ in starts]
+    for line in keep_lines:
+        j = bisect.bisect_right(lines, line)
+        if j > 0:
+            first = bisect.bisect_left(lines, lines[j - 1])
+            keep.update(i for _, i in starts[first:j])
+
+    names = list(ROOTS)
+    for i, (_, used, threads) in enumerate(nodes):
+        names.extend(threads)
+        if i in keep:
+            names.extend(used)
+    seen = set()
+    while names:
+        name = names.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        for i in definers.get(name, ()):
+            if i not in keep:
+                keep.add(i)
+                names.extend(nodes[i][1])
+
+    ast.ext = [node for i, node in enumerate(ast.ext) if i in keep]
 
 
 # Known bug: pycparser cannot handle curly braces inside parentheses. Example:
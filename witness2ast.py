@@ -14,7 +14,8 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import networkx as nx
+from xml.etree import ElementTree
+
 from pycparser.c_ast import (
     Compound,
     If,
@@ -23,148 +24,424 @@ from pycparser.c_ast import (
     For,
     FuncDef,
     FuncCall,
-    NodeVisitor,
     ID,
     ExprList,
     Constant,
     Assignment,
 )
+import bisect
 import re
 
+import profiling
 from Exceptions import KnownErrorVerdict
 
 
-def get_offset_of_line(c_file, line):
-    with open(c_file, "r") as f:
-        for i in range(1, line):
-            f.readline()
-        return f.tell()
+class SourcePositions:
+    """Converts between lines and (byte) offsets of a source text.
 
+    Lines end at "\n", "\r\n" or "\r", as for files opened in text mode.
+    """
 
-def get_line_of_offset(c_file, offset):
-    with open(c_file, "r") as f:
-        i = 0
-        line = ""
-        while f.tell() <= offset:
-            line = f.readline()
-            i = i + 1
-        return i, len(line) - (f.tell() - offset)
+    def __init__(self, source):
+        self.content = source.encode()
+        self.starts = [0]
+        self.starts.extend(m.end() for m in re.finditer(rb"\r\n|\r|\n", self.content))
+
+    def offset_of_line(self, line):
+        if line <= 1:
+            return 0
+        if line - 1 < len(self.starts):
+            return self.starts[line - 1]
+        return len(self.content)
+
+    def line_of_offset(self, offset):
+        line = bisect.bisect_right(self.starts, offset)
+        return line, offset - self.starts[line - 1]
 
+    def read(self, offset, length):
+        return self.content[offset : offset + length].decode(errors="replace")
 
-def get_coords(c_file, startline=None, endline=None, startoffset=None, endoffset=None):
+
+def get_coords(
+    positions, startline=None, endline=None, startoffset=None, endoffset=None
+):
     if not endline and startline:
         endline = startline
 
     if not startoffset and startline:
-        startoffset = get_offset_of_line(c_file, int(startline))
+        startoffset = positions.offset_of_line(int(startline))
 
     if not endoffset and endline:
-        endoffset = get_offset_of_line(c_file, int(endline) + 1)
+        endoffset = positions.offset_of_line(int(endline) + 1)
 
     if endoffset:
-        with open(c_file, "r") as f:
-            f.seek(int(startoffset))
-            content = f.read(int(endoffset) - int(startoffset) - 1)
-            startline, column = get_line_of_offset(c_file, int(startoffset))
-            return {
-                "startline": int(startline),
-                "column": int(column),
-                "endline": int(endline),
-                "length": int(endoffset) - int(startoffset) + 1,
-                "content": content,
-            }
+        content = positions.read(
+            int(startoffset), int(endoffset) - int(startoffset) - 1
+        )
+        startline, column = positions.line_of_offset(int(startoffset))
+        return {
+            "startline": int(startline),
+            "column": int(column),
+            "endline": int(endline),
+            "length": int(endoffset) - int(startoffset) + 1,
+            "content": content,
+        }
     return None
 
 
-def find_nondet_assignment_on_line(ast, target_line):
-    class LineVisitor(NodeVisitor):
-        def __init__(self, target_line):
-            self.target_line = target_line
-            self.found = False
-            self.statement = None
-            self.parent = None
-
-        def visit(self, node):
-            if not self.found:
-                super().visit(node)
-
-        def visit_Compound(self, node):
-            if self.found:
-                return
-            for stmt in node.block_items if node.block_items else [node]:
-                if hasattr(stmt, "coord") and stmt.coord:
-                    line = stmt.coord.line
-                    if (
-                        line >= self.target_line
-                        and type(stmt) == Assignment
-                        and type(stmt.rvalue) == FuncCall
-                        and "__VERIFIER_nondet" in stmt.rvalue.name.name
-                    ):
-                        self.statement = stmt
-                        self.parent = node
-                        self.found = True
-                        return
-                self.generic_visit(stmt)
-
-    line_visitor = LineVisitor(target_line)
-    line_visitor.visit(ast)
-
-    if line_visitor.statement:
-        return line_visitor.statement, line_visitor.parent
-    else:
-        return None, None
-
-
-def find_first_statement_on_line(ast, target_line):
-    class LineVisitor(NodeVisitor):
-        def __init__(self, target_line):
-            self.target_line = target_line
-            self.found = False
-            self.statement = None
-            self.parent = None
-
-        def visit(self, node):
-            if not self.found:
-                super().visit(node)
-
-        def visit_Compound(self, node):
-            if self.found:
-                return
-            for stmt in node.block_items if node.block_items else [node]:
-                if hasattr(stmt, "coord") and stmt.coord:
-                    line = stmt.coord.line
-                    if line >= self.target_line:
-                        self.statement = stmt
-                        self.parent = node
-                        self.found = True
-                        return
-                self.generic_visit(stmt)
-
-    line_visitor = LineVisitor(target_line)
-    line_visitor.visit(ast)
-
-    if line_visitor.statement:
-        return line_visitor.statement, line_visitor.parent
-    else:
-        return None, None
-
-
-def extract_metadata(witnessfile, c_file):
-    witness = nx.read_graphml(witnessfile)
+def is_nondet_assignment(stmt):
+    return (
+        type(stmt) == Assignment
+        and type(stmt.rvalue) == FuncCall
+        and isinstance(stmt.rvalue.name, ID)
+        and "__VERIFIER_nondet" in stmt.rvalue.name.name
+    )
+
+
+class Statement:
+    """An item of a compound statement (or an empty compound itself).
+
+    `frame` is the item whose subtree contains the compound, `rank` is the
+    index among the items of the same compound, `position` the index in its
+    block_items before the planned insertions (None for empty compounds).
+    """
+
+    __slots__ = ("line", "node", "parent", "position", "rank", "frame")
+
+    def __init__(self, node, parent, position, rank, frame):
+        self.line = node.coord.line if getattr(node, "coord", None) else None
+        self.node = node
+        self.parent = parent
+        self.position = position
+        self.rank = rank
+        self.frame = frame
+
+    def matches(self, target_line, nondet):
+        return (
+            self.line is not None
+            and self.line >= target_line
+            and (not nondet or is_nondet_assignment(self.node))
+        )
+
+    def within(self, ancestor):
+        frame = self.frame
+        while frame is not None and frame is not ancestor:
+            frame = frame.frame
+        return frame is ancestor
+
+
+class StatementIndex:
+    """The candidate statements of witness edges, built in one walk of the AST.
+
+    Lookups answer what a NodeVisitor checking the items of every compound
+    (and stopping at the first item on or after the target line) finds: the
+    first candidate in pre-order, found by bisecting the running maximum of
+    the lines, which is then replaced by the next matching item of every
+    enclosing compound, as the visitor kept checking the remaining items of
+    the enclosing compounds after a match in a nested one.
+
+    Insertions are only planned (see EditPlan), so the positions stay the
+    indices of the original items. After the children of a candidate are
+    wrapped into new compounds, `refresh` re-collects its subtree.
+    """
+
+    def __init__(self, ast):
+        self.siblings = {}
+        self.statements = self.collect([(ast, None)])
+        self.lines = []
+        self.nondet_lines = []
+        self.update_lines(0, len(self.statements))
+
+    def collect(self, work):
+        # Work items are nodes to visit (with their frame) or items to check
+        statements = []
+        stack = list(reversed(work))
+        while stack:
+            node, frame = stack.pop()
+            if isinstance(node, Statement):
+                if node.line is not None:
+                    statements.append(node)
+                continue
+            work = []
+            if isinstance(node, Compound):
+                items = node.block_items if node.block_items else [node]
+                siblings = self.siblings[id(node)] = []
+                for i, stmt in enumerate(items):
+                    position = i if node.block_items else None
+                    statement = Statement(stmt, node, position, i, frame)
+                    siblings.append(statement)
+                    work.append((statement, None))
+                    work.extend((child, statement) for child in stmt)
+            else:
+                work.extend((child, frame) for child in node)
+            stack.extend(reversed(work))
+        return statements
+
+    def update_lines(self, start, unchanged):
+        """Recomputes the running maxima of the lines (of all candidates and of
+        the nondet assignments) from `start`. The candidates from `unchanged`
+        on are the same as before, so it stops once the maxima agree again."""
+        for i in range(start, len(self.statements)):
+            statement = self.statements[i]
+            line = statement.line
+            nondet_line = line if is_nondet_assignment(statement.node) else -1
+            if i > 0:
+                line = max(line, self.lines[i - 1])
+                nondet_line = max(nondet_line, self.nondet_lines[i - 1])
+            if i < len(self.lines):
+                if (
+                    i >= unchanged
+                    and self.lines[i] == line
+                    and self.nondet_lines[i] == nondet_line
+                ):
+                    return
+                self.lines[i] = line
+                self.nondet_lines[i] = nondet_line
+            else:
+                self.lines.append(line)
+                self.nondet_lines.append(nondet_line)
+
+    def lookup(self, lines, target_line, nondet):
+        i = bisect.bisect_left(lines, target_line)
+        # assignments that already received their value no longer match
+        while i < len(self.statements) and not self.statements[i].matches(
+            target_line, nondet
+        ):
+            i = i + 1
+        if i == len(self.statements):
+            return None
+        statement = self.statements[i]
+        frame = statement.frame
+        while frame is not None:
+            for sibling in self.siblings[id(frame.parent)][frame.rank + 1 :]:
+                if sibling.matches(target_line, nondet):
+                    statement = sibling
+                    break
+            frame = frame.frame
+        return statement
+
+    def first_statement(self, target_line):
+        return self.lookup(self.lines, target_line, False)
+
+    def first_nondet_assignment(self, target_line):
+        return self.lookup(self.nondet_lines, target_line, True)
+
+    def refresh(self, statement):
+        start = bisect.bisect_left(self.lines, statement.line)
+        while self.statements[start] is not statement:
+            start = start + 1
+        end = start + 1
+        while end < len(self.statements) and self.statements[end].within(statement):
+            end = end + 1
+        collected = self.collect([(child, statement) for child in statement.node])
+        self.statements[start + 1 : end] = collected
+        self.lines[start + 1 : end] = [0] * len(collected)
+        self.nondet_lines[start + 1 : end] = [0] * len(collected)
+        self.update_lines(start + 1, start + 1 + len(collected))
+
+
+class EditPlan:
+    """Insertions into the items of compound statements, applied at once.
+
+    The result is the same as inserting every node right away, at the current
+    index of the item it is placed before or after: nodes placed before an
+    item keep their order, nodes placed after it are in reverse order, and
+    between two items the nodes placed after the first one come first.
+    """
+
+    def __init__(self):
+        self.edits = {}
+
+    def edits_of(self, parent):
+        if id(parent) not in self.edits:
+            self.edits[id(parent)] = (parent, {}, {})
+        return self.edits[id(parent)]
+
+    def insert_before(self, statement, node):
+        _, before, _ = self.edits_of(statement.parent)
+        before.setdefault(statement.position, []).append(node)
+
+    def insert_after(self, statement, node):
+        _, _, after = self.edits_of(statement.parent)
+        after.setdefault(statement.position, []).append(node)
+
+    def apply(self):
+        """Rebuilds the items of every edited compound in a single pass."""
+        for parent, before, after in self.edits.values():
+            items = []
+            for position, item in enumerate(parent.block_items):
+                items.extend(before.get(position, ()))
+                items.append(item)
+                items.extend(reversed(after.get(position, ())))
+            parent.block_items = items
+        self.edits = {}
+
+
+GRAPHML_TYPES = {
+    "integer": int,
+    "yfiles": str,
+    "string": str,
+    "int": int,
+    "long": int,
+    "float": float,
+    "double": float,
+    "boolean": bool,
+}
+GRAPHML_BOOLEANS = {"true": True, "false": False, "0": False, "1": True}
+NODE_FLAGS = ["entry", "isEntryNode", "sink", "isSinkNode"]
+EDGE_ATTRIBUTES = [
+    "startline",
+    "endline",
+    "startoffset",
+    "endoffset",
+    "assumption",
+    "control",
+    "threadId",
+    "createThread",
+]
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+class WitnessGraph:
+    """The parts of a GraphML witness that extract_metadata uses.
+
+    The file is read in a single streaming pass, keeping only the graph
+    attributes, the nodes carrying entry/sink flags and the used attributes of
+    the edges. Data is decoded the way networkx.read_graphml would (typed by
+    the keys); with parallel edges, networkx returned a multigraph, whose
+    out_edges repeated the parallel edges and whose edge data did not contain
+    the attributes directly, which is also kept.
+    """
+
+    def __init__(self, witnessfile):
+        self.keys = {}
+        self.graph = None
+        self.directed = True
+        self.flagged = {flag: [] for flag in NODE_FLAGS}
+        self.successors = {}
+        self.has_predecessor = set()
+        self.multigraph = False
+        self.read(witnessfile)
+
+    def decode_data(self, element, data):
+        key = element.get("key")
+        if key not in self.keys:
+            raise ValueError(f"Bad GraphML data: no key {key}")
+        name, data_type = self.keys[key]
+        if element.text is not None and len(element) == 0:
+            if data_type == bool:
+                data[name] = GRAPHML_BOOLEANS[element.text.lower()]
+            else:
+                data[name] = data_type(element.text)
+        elif element.text is None and len(element) == 0:
+            data[name] = ""
+
+    def decode(self, element):
+        data = {}
+        for child in element:
+            if local_name(child.tag) == "data":
+                self.decode_data(child, data)
+        return data
+
+    def read_key(self, element):
+        name = element.get("attr.name")
+        data_type = element.get("attr.type")
+        if element.get("yfiles.type") is not None:
+            name = element.get("yfiles.type")
+            data_type = "yfiles"
+        if data_type is None:
+            data_type = "string"
+        if name is None:
+            raise ValueError(f"Unknown key for id {element.get('id')}.")
+        self.keys[element.get("id")] = (name, GRAPHML_TYPES[data_type])
+
+    def read_node(self, element):
+        data = self.decode(element)
+        for flag in NODE_FLAGS:
+            if flag in data:
+                self.flagged[flag].append(element.get("id"))
+
+    def read_edge(self, element):
+        directed = element.get("directed")
+        if (self.directed and directed == "false") or (
+            not self.directed and directed == "true"
+        ):
+            raise ValueError("Mixed directed and undirected edges")
+        source = element.get("source")
+        target = element.get("target")
+        data = self.decode(element)
+        attrs = {key: data[key] for key in EDGE_ATTRIBUTES if key in data}
+        successors = self.successors.setdefault(source, {})
+        if target in successors:
+            self.multigraph = True
+            successors[target][0] = successors[target][0] + 1
+            successors[target][1].update(attrs)
+        else:
+            successors[target] = [1, attrs]
+        self.has_predecessor.add(target)
+
+    def read(self, witnessfile):
+        depth = 0
+        graph = None
+        current = None
+        for event, element in ElementTree.iterparse(witnessfile, ("start", "end")):
+            if event == "start":
+                depth = depth + 1
+                if depth == 2:
+                    current = element
+                    if graph is None and local_name(element.tag) == "graph":
+                        graph = element
+                        self.graph = {}
+                        self.directed = element.get("edgedefault") == "directed"
+                continue
+            depth = depth - 1
+            name = local_name(element.tag)
+            if depth == 1 and name == "key":
+                self.read_key(element)
+            elif depth == 2 and current is graph:
+                if name == "data":
+                    self.decode_data(element, self.graph)
+                elif name == "node":
+                    self.read_node(element)
+                elif name == "edge":
+                    self.read_edge(element)
+                del graph[:]
+        if graph is None:
+            raise ValueError("file not successfully read as graphml")
+
+    def sources(self):
+        if not self.directed:
+            raise ValueError("Undirected witness")
+        return [u for u in self.successors if u not in self.has_predecessor]
+
+    def out_edges(self, node):
+        if not self.directed:
+            raise ValueError("Undirected witness")
+        targets = []
+        for target, (count, _) in self.successors.get(node, {}).items():
+            targets.extend([target] * count)
+        return targets
+
+    def edge_data(self, source, target):
+        return {} if self.multigraph else self.successors[source][target][1]
+
+
+def extract_metadata(witnessfile, source):
+    witness = WitnessGraph(witnessfile)
     if witness.graph["witness-type"] != "violation_witness":
         raise KnownErrorVerdict("Correctness witness")
     ret = []
+    positions = SourcePositions(source)
 
-    keys = {k for node in witness.nodes for k in witness.nodes[node].keys()}
-    entry_key = "entry" if "entry" in keys else "isEntryNode"
-    sink_key = "sink" if "sink" in keys else "isSinkNode"
+    entry_key = "entry" if witness.flagged["entry"] else "isEntryNode"
+    sink_key = "sink" if witness.flagged["sink"] else "isSinkNode"
 
-    entry_nodes = list(nx.get_node_attributes(witness, entry_key).keys())
+    entry_nodes = witness.flagged[entry_key]
     if len(entry_nodes) == 0:
-        entry_nodes = list(
-            set([u for u, deg in witness.in_degree() if not deg])
-            - set([u for u, deg in witness.out_degree() if not deg])
-        )
+        entry_nodes = witness.sources()
         if len(entry_nodes) == 0:
             raise KnownErrorVerdict("No entry node")
 
@@ -173,30 +450,28 @@ def extract_metadata(witnessfile, c_file):
 
     node = entry_nodes[0]
 
-    sink_nodes = set(nx.get_node_attributes(witness, sink_key).keys())
+    sink_nodes = set(witness.flagged[sink_key])
 
     while len(witness.out_edges(node)) > 0:
-        out_edges = list(
-            filter(lambda x: x[1] not in sink_nodes, witness.out_edges(node))
-        )
+        out_edges = [v for v in witness.out_edges(node) if v not in sink_nodes]
         if len(out_edges) > 1:
             raise KnownErrorVerdict("Has branching")
-        edge = list(out_edges)[0]
-        attrs = witness.get_edge_data(edge[0], edge[1])
+        target = out_edges[0]
+        attrs = witness.edge_data(node, target)
 
         startline = attrs["startline"] if "startline" in attrs else None
         endline = attrs["endline"] if "endline" in attrs else None
         startoffset = attrs["startoffset"] if "startoffset" in attrs else None
         endoffset = attrs["endoffset"] if "endoffset" in attrs else None
 
-        coords = get_coords(c_file, startline, endline, startoffset, endoffset)
+        coords = get_coords(positions, startline, endline, startoffset, endoffset)
         metadata = {
             key: attrs[key]
             for key in ["assumption", "control", "threadId", "createThread"]
             if key in attrs
         }
         ret.append((coords, metadata))
-        node = edge[1]
+        node = target
 
     return ret
 
@@ -229,12 +504,46 @@ nondet_return_types = {
 }
 
 
-def apply_witness(ast, c_file, witnessfile):
-    funcdefs = {}
-    for node in ast.ext:
-        if isinstance(node, FuncDef):
-            funcdefs[node.decl.name] = node.body
-    metadata = extract_metadata(witnessfile, c_file)
+def witness_lines(metadata):
+    """Returns the lines the edges of the witness point at."""
+    lines = set()
+    for coords, _ in metadata:
+        if coords and "startline" in coords:
+            lines.update(range(coords["startline"], coords["endline"] + 1))
+    return lines
+
+
+def top_level(statement, functions):
+    """Returns the function definition containing the statement (None if it
+    is unknown)."""
+    while statement.frame is not None:
+        statement = statement.frame
+    return functions.get(id(statement.parent))
+
+
+def apply_witness(ast, source, witnessfile):
+    """Instruments the AST, see apply_metadata."""
+    with profiling.phase("extract_metadata"):
+        metadata = extract_metadata(witnessfile, source)
+    profiling.count("witness_edges", len(metadata))
+    with profiling.phase("apply_witness"):
+        return apply_metadata(ast, metadata)
+
+
+def apply_metadata(ast, metadata):
+    """Instruments the AST in two phases: every edge is resolved to its
+    statement while the insertions are only planned, then the compounds
+    receiving yield/release calls are rebuilt once each.
+
+    Returns the lines the witness points at, the top-level nodes it modified,
+    and whether the witness is fully ordered: every edge belongs to a thread,
+    and every thread switch became a step.
+    """
+    index = StatementIndex(ast)
+    plan = EditPlan()
+    functions = {id(node.body): node for node in ast.ext if isinstance(node, FuncDef)}
+    modified = set()
+    ordered = True
     threadid = metadata[0][1]["threadId"] if "threadId" in metadata[0][1] else 0
     i = 0
     # TODO not perfect regex, but hard to solve well for everything ( e.g., assumption: !(var == 1) and variants )
@@ -243,10 +552,9 @@ def apply_witness(ast, c_file, witnessfile):
     for coords, data in metadata:
         # TODO current implementation is limited: will not work if single assignment executes 1+ time (e.g., in a loop)
         if "assumption" in data and "content" in coords and "startline" in coords:
-            nondet_assign_node, first_parent = find_nondet_assignment_on_line(
-                ast, coords["startline"]
-            )
-            if nondet_assign_node is not None:
+            statement = index.first_nondet_assignment(coords["startline"])
+            if statement is not None:
+                nondet_assign_node = statement.node
                 assumptions = {}
                 matches = re.findall(assumption_pattern, data["assumption"])
                 for i, (varname, value) in enumerate(matches, 1):
@@ -262,15 +570,17 @@ def apply_witness(ast, c_file, witnessfile):
                         nondet_assign_node.rvalue = Constant(
                             type=ret_type, value=assumptions[varname]
                         )
+                        modified.add(top_level(statement, functions))
         elif (
             (data["threadId"] if "threadId" in data else threadid) != threadid
             and coords
             and "startline" in coords
         ):
             threadid = data["threadId"] if "threadId" in data else threadid
-            nondet_assign_node, first_parent = find_first_statement_on_line(
-                ast, coords["startline"]
-            )
+            statement = index.first_statement(coords["startline"])
+            if statement is None or statement.position is None:
+                raise KnownErrorVerdict("Incompatible witness")
+            nondet_assign_node = statement.node
 
             yield_func = FuncCall(
                 ID("yield"),
@@ -292,12 +602,14 @@ def apply_witness(ast, c_file, witnessfile):
             )
 
             i = i + 1
-            first_index = first_parent.block_items.index(nondet_assign_node)
-            first_parent.block_items.insert(first_index, yield_func)
+            plan.insert_before(statement, yield_func)
+            modified.add(top_level(statement, functions))
+            profiling.count("yield_points", 1)
             if isinstance(nondet_assign_node, (Compound, While, DoWhile, For)):
                 nondet_assign_node.stmt = Compound(
                     block_items=[release_func, nondet_assign_node.stmt]
                 )
+                index.refresh(statement)
             elif isinstance(nondet_assign_node, If):
                 if nondet_assign_node.iftrue:
                     nondet_assign_node.iftrue = Compound(
@@ -307,5 +619,11 @@ def apply_witness(ast, c_file, witnessfile):
                     nondet_assign_node.iffalse = Compound(
                         block_items=[release_func, nondet_assign_node.iffalse]
                     )
+                index.refresh(statement)
             else:
-                first_parent.block_items.insert(first_index + 2, release_func)
+                plan.insert_after(statement, release_func)
+        if "threadId" not in data or data["threadId"] != threadid:
+            ordered = False
+
+    plan.apply()
+    return witness_lines(metadata), modified, ordered